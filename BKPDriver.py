@@ -4,6 +4,7 @@ import struct
 import time
 from threading import Lock
 
+from capture import CaptureWriter, REQUEST, REPLY
 from driver import GenericPSUDriver
 import numpy as np
 
@@ -18,19 +19,54 @@ class SyncBKPDriver(object):
     INVALID_CMD = 0xC0
     SUCCESS = 0x80
 
+    STATUS_FRAME = 0x12
+    FRAME_SIZE = 26
+
     # properties
     MIN_VOLTS = 0
     MAX_VOLTS = 18
     MIN_CURRENT = 0
     MAX_CURRENT = 5
-
-    def __init__(self, baudrate, dev_addr, serial_port=None):
+    DEFAULT_TIMEOUT = 1.0  # Seconds to wait for a reply without a profile
+
+    def __init__(self,
+                 baudrate,
+                 dev_addr,
+                 serial_port=None,
+                 transport=None,
+                 capture_path=None,
+                 profile=None):
+        """
+        Args:
+            baudrate: Baud rate of the serial link.
+            dev_addr: Address of the device on the bus.
+            serial_port: Serial port the device is connected to.
+            transport: Optional callable returning a serial-like context
+                       manager, e.g. a capture.ReplayTransport. Defaults to
+                       opening the serial port.
+            capture_path: Optional path of a capture file recording every
+                          request and reply frame.
+            profile: Optional link profile measured by autotune, with the
+                     "baudrate", the reply "timeout" and the minimum
+                     "inter_frame_gap" in seconds. The baudrate of the
+                     profile takes precedence. Without a profile, replies
+                     time out after DEFAULT_TIMEOUT.
+        """
+        profile = profile or {}
         self.address = dev_addr
-        self.baudrate = baudrate
+        self.baudrate = profile.get("baudrate", baudrate)
+        self.timeout = profile.get("timeout", self.DEFAULT_TIMEOUT)
+        self.inter_frame_gap = profile.get("inter_frame_gap", 0)
         self.port = serial_port
         self.logger = logging.getLogger()
         self.controlling = False
+        self.transport = transport or self.__open_serial
+        self.capture = CaptureWriter(capture_path) if capture_path else None
         self.__serial_lock = Lock()
+        self.__last_frame = 0
+
+    def __open_serial(self):
+        return serial.Serial(self.port, self.baudrate, timeout=self.timeout)
 
     def __check_crc(self, data, crc):
         s = sum(data) % 256
@@ -38,10 +74,20 @@ class SyncBKPDriver(object):
 
     def __send(self, data, reply=False):
         with self.__serial_lock:
-            with serial.Serial(self.port, self.baudrate) as ser:
-                ser.write(data)
-                reply_data = ser.read(26)
-                return reply_data
+            gap = self.inter_frame_gap - (time.monotonic() - self.__last_frame)
+            if gap > 0:
+                time.sleep(gap)
+            try:
+                with self.transport() as ser:
+                    if self.capture:
+                        self.capture.record(REQUEST, data)
+                    ser.write(data)
+                    reply_data = ser.read(self.FRAME_SIZE)
+                    if self.capture:
+                        self.capture.record(REPLY, reply_data)
+                    return reply_data
+            finally:
+                self.__last_frame = time.monotonic()
 
     def __prepare_request(self, cmd, data_bytes, reply=False):
         request = np.zeros(26, dtype=np.uint8)
@@ -50,25 +96,28 @@ class SyncBKPDriver(object):
         request[2] = cmd
         for i, byte in enumerate(data_bytes):
             request[3 + i] = byte
-        checksum = sum(request) % 256
+        checksum = int(request.sum()) % 256
         request[-1] = checksum
         msg = self.__send(bytearray(request))
 
         if not msg:
             raise IOError("Unable to send message")
 
+        if len(msg) < self.FRAME_SIZE:
+            raise IOError("Timed out waiting for the reply")
+
         if not self.__check_crc(msg[:-1], msg[-1]):
             raise IOError("CRC check failed")
 
-        if msg[3] == 0x12:  # Check for status msg
-            statuscode = msg[4]
-            if statuscode == SUCCESS:
+        if msg[2] == self.STATUS_FRAME:  # Check for status msg
+            statuscode = msg[3]
+            if statuscode == self.SUCCESS:
                 self.logger.debug("Request with cmd %d was successful", cmd)
             else:
                 self.logger.warn(
                     "Request with cmd %d failed with error code %d", cmd,
                     statuscode)
-            return statuscode == SUCCESS
+            return statuscode == self.SUCCESS
 
         return msg
 
@@ -79,6 +128,15 @@ class SyncBKPDriver(object):
     def __exit__(self, *args):
         self.set_control(False)
 
+    def close(self):
+        """
+        Closes the capture file, if any.
+        """
+        with self.__serial_lock:
+            if self.capture:
+                self.capture.close()
+                self.capture = None
+
     def __encode_float_value(self, val, fp=3):
         val_int = int(val * (10**fp))  # Convert to fixed point format.
         return struct.pack("<I", val_int)  # convert to little endian
@@ -94,12 +152,12 @@ class SyncBKPDriver(object):
         Sets the device to be controllable with remote session.
         Args:
             control: Boolean corresponding to the control status,
-                     True for remote control, and False otherwise.
+                     True or "True" for remote control, and False otherwise.
         Return:
             Boolean indication success.
         """
         cmd = 0x20  # Remote control mode
-        data = [1 if control else 0]
+        data = [1 if control in (True, "True") else 0]
         if self.__prepare_request(cmd, data, reply=False):
             self.controlling = True
             return True
@@ -109,16 +167,16 @@ class SyncBKPDriver(object):
         """
         Sets the output state
         Args:
-            state: Boolean with True for ON and False for OFF.
+            state: Boolean with True or "True" for ON and False for OFF.
         Returns:
             True on success
         """
         # YA: Might be confusing with booleans for state and return.
         cmd = 0x21
-        data = [1 if state else 0]
+        data = [1 if state in (True, "True") else 0]
 
         if self.__prepare_request(cmd, data, reply=False):
-            self.state = state
+            self.state = data[0] == 1
             return True
 
         return False
@@ -181,7 +239,7 @@ class SyncBKPDriver(object):
         """
         cmd = 0x26
         reply = self.__prepare_request(cmd, [], reply=True)
-        self.last_read_req = time.clock()
+        self.last_read_req = time.monotonic()
         self.last_reply = reply
 
         output = {
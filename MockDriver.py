@@ -1,11 +1,98 @@
 from driver import GenericPSUDriver
 import os
+import time
 import numpy as np
 import redis
 
 
-class MockPSUDriver(object):
-    """ Mock driver to be used without the instrument """
+class LoadModel(object):
+    """ Vectorized physical model of the supply output driving a load """
+    # properties
+    DEFAULT_RESISTANCE = 500  # Ohms
+    DEFAULT_CAPACITANCE = 100e-6  # Farads
+    DEFAULT_SLEW_RATE = 1000  # Volts per second
+
+    def __init__(self,
+                 resistance=DEFAULT_RESISTANCE,
+                 capacitance=DEFAULT_CAPACITANCE,
+                 slew_rate=DEFAULT_SLEW_RATE,
+                 noise_mean=0,
+                 noise_std_dev=0,
+                 seed=None):
+        self.resistance = resistance
+        self.capacitance = capacitance
+        self.slew_rate = slew_rate
+        self.noise_mean = noise_mean
+        self.noise_std_dev = noise_std_dev
+        self.voltage = 0.0
+        self.mode = "CV"
+        self.rng = np.random.RandomState(seed)
+
+    def target_voltage(self, volts, max_curr, state):
+        """
+        Computes the steady state output voltage.
+        Args:
+            volts: Voltage setting.
+            max_curr: Current limit.
+            state: Output state.
+        Returns:
+            Tuple of the target voltage and the regulation mode, "CV" or "CC".
+        """
+        if not state:
+            return 0.0, "CV"
+        if volts > max_curr * self.resistance:
+            return max_curr * self.resistance, "CC"
+        return float(volts), "CV"
+
+    def simulate(self, n, dt, volts, max_curr, state):
+        """
+        Evolves the output over a block of samples.
+        The output capacitor settles towards the target voltage with the
+        load RC time constant, limited by the slew rate, and the supply
+        current is clamped to the current limit while the output is on.
+        Args:
+            n: Number of samples.
+            dt: Time between samples in seconds.
+            volts: Voltage setting.
+            max_curr: Current limit.
+            state: Output state.
+        Returns:
+            Tuple of (voltage, current) numpy arrays of length n.
+        """
+        target, self.mode = self.target_voltage(volts, max_curr, state)
+        v0 = self.voltage
+        t = dt * np.arange(1, n + 1)
+        tau = self.resistance * self.capacitance
+
+        if tau > 0:
+            voltage = target + (v0 - target) * np.exp(-t / tau)
+        else:
+            voltage = np.full(n, target)
+        if state and self.slew_rate:
+            ramp = v0 + np.sign(target - v0) * np.minimum(
+                self.slew_rate * t, abs(target - v0))
+            # The slower of the two trajectories governs the output
+            voltage = np.where(
+                np.abs(voltage - v0) < np.abs(ramp - v0), voltage, ramp)
+
+        dv_dt = np.diff(np.concatenate(([v0], voltage))) / dt
+        if state:
+            current = np.clip(voltage / self.resistance +
+                              self.capacitance * dv_dt, 0, max_curr)
+        else:
+            current = np.zeros(n)
+        self.voltage = float(voltage[-1])
+
+        if state and self.noise_std_dev:
+            noise = self.rng.normal(self.noise_mean, self.noise_std_dev,
+                                    (2, n))
+            voltage = voltage + np.abs(noise[0])
+            current = current + np.abs(noise[1])
+        return voltage, current
+
+
+class SimulatedPSUDriver(object):
+    """ In-memory simulated power supply driven by a LoadModel """
     # properties
     MIN_VOLTS = 0  # Volts
     MAX_VOLTS = 18  # Volts
@@ -14,26 +101,20 @@ class MockPSUDriver(object):
     MIN_CURRENT = 0  # Amps
     MAX_CURRENT = 5  # Amps
 
-    DEFAULT_RESISTANCE = 500  # Ohms
+    DEFAULT_RESISTANCE = LoadModel.DEFAULT_RESISTANCE  # Ohms
 
-    def __init__(self, output_noise_mean, output_noise_std_dev):
-        self.output_noise = lambda: output_noise_std_dev * np.random.randn() + output_noise_mean
+    def __init__(self, output_noise_mean, output_noise_std_dev, **load_kwargs):
+        load_kwargs.setdefault("resistance", self.DEFAULT_RESISTANCE)
+        self.load = LoadModel(
+            noise_mean=output_noise_mean,
+            noise_std_dev=output_noise_std_dev,
+            **load_kwargs)
         self.voltage_setting = self.DEFAULT_VOLTS
         self.state = False
         self.max_output_current_setting = self.MAX_CURRENT
         self.max_output_voltage_setting = self.MAX_VOLTS
-        self.resistance = self.DEFAULT_RESISTANCE
-        self.r = redis.StrictRedis.from_url(os.environ['REDIS_URL'])
-        self.__set_redis_defautlts()
-
-    def __set_redis_defautlts(self):
-        self.voltage_setting = self.r.set('volts', self.voltage_setting)
-        self.state = self.r.set('state', self.max_output_current_setting)
-        self.resistance = self.r.set('resistance', self.resistance)
-        self.max_output_current_setting = self.r.set(
-            'max_curr', self.max_output_current_setting)
-        self.max_output_voltage_setting = self.r.set(
-            'max_volts', self.max_output_voltage_setting)
+        self.resistance = self.load.resistance
+        self.last_read = time.monotonic()
 
     def __enter__(self):
         pass
@@ -43,7 +124,7 @@ class MockPSUDriver(object):
 
     def set_control(self, control):
         """
-        Not used in mock driver.
+        Not used in simulated driver.
         """
         pass
 
@@ -55,8 +136,7 @@ class MockPSUDriver(object):
         Returns:
             "True" on success
         """
-        self.state = state
-        self.r.set('state', state)
+        self.state = state in (True, "True")
         return "True"
 
     def set_max_output_voltage(self, volts):
@@ -67,18 +147,16 @@ class MockPSUDriver(object):
         Returns:
             Boolean indicating success
         """
-        curr_volts = float(self.r.get('volts'))
         if volts > self.MAX_VOLTS:
             raise ValueError(
                 "This power supply cannot supply more than {}V!".format(
                     self.MAX_VOLTS))
-        elif volts < curr_volts:
+        elif volts < self.voltage_setting:
             raise ValueError(
                 "Cannot set max voltage lower than the current voltage {}V!".
-                format(curr_volts))
+                format(self.voltage_setting))
 
         self.max_output_voltage_setting = volts
-        self.r.set('max_volts', volts)
         return "True"
 
     def set_max_output_current(self, curr):
@@ -95,7 +173,6 @@ class MockPSUDriver(object):
                     self.MAX_CURRENT))
 
         self.max_output_current_setting = curr
-        self.r.set('max_curr', curr)
         return "True"
 
     def set_output_voltage(self, volts):
@@ -106,13 +183,11 @@ class MockPSUDriver(object):
         Returns:
             Boolean indicating success
         """
-        max_volts = float(self.r.get('max_volts'))
-        if volts > max_volts or volts < self.MIN_VOLTS:
-            raise ValueError(
-                "The maximum output voltage is {}V!".format(max_volts))
+        if volts > self.max_output_voltage_setting or volts < self.MIN_VOLTS:
+            raise ValueError("The maximum output voltage is {}V!".format(
+                self.max_output_voltage_setting))
 
         self.voltage_setting = volts
-        self.r.set('volts', volts)
         return "True"
 
     def set_output_current(self, curr):
@@ -127,7 +202,6 @@ class MockPSUDriver(object):
             raise ValueError("Invalid Current")
 
         self.max_output_current_setting = curr
-        self.r.set('max_curr', curr)
         return "True"
 
     def set_load(self, resistance):
@@ -137,11 +211,16 @@ class MockPSUDriver(object):
             resistance: Resistance to use
         """
         self.resistance = resistance
-        self.r.set('resistance', resistance)
+        self.load.resistance = resistance
+
+    def _simulate(self, n, dt):
+        return self.load.simulate(n, dt, self.voltage_setting,
+                                  self.max_output_current_setting, self.state)
 
     def read_supply_values(self):
         """
-        Reads a value dict from the power supply.
+        Reads a value dict from the power supply, advancing the load model
+        by the time elapsed since the previous read.
         Returns:
             A dict with the following:
                 {
@@ -153,22 +232,105 @@ class MockPSUDriver(object):
                     "maximum_voltage_setting": xx.xx,
                 }
         """
-        self.voltage_setting = float(self.r.get('volts'))
-        self.state = self.r.get('state') == b"True"
-        self.resistance = float(self.r.get('resistance'))
-        self.max_output_current_setting = float(self.r.get('max_curr'))
-        self.max_output_voltage_setting = float(self.r.get('max_volts'))
+        now = time.monotonic()
+        dt = max(now - self.last_read, 1e-6)
+        self.last_read = now
+        voltage, current = self._simulate(1, dt)
 
-        current = abs(self.output_noise()) + (
-            self.voltage_setting / self.resistance) if self.state else 0
-        voltage = abs(
-            self.output_noise()) + (self.voltage_setting) if self.state else 0
         output = {
-            "output_current": current,
-            "output_voltage": voltage,
+            "output_current": float(current[-1]),
+            "output_voltage": float(voltage[-1]),
             "state": self.state,
             "voltage_value_setting": self.voltage_setting,
             "maximum_current_setting": self.max_output_current_setting,
             "maximum_voltage_setting": self.max_output_voltage_setting
         }
         return output
+
+    def read_supply_values_batch(self, n, dt):
+        """
+        Simulates n consecutive readings at a fixed sample period without
+        waiting in real time.
+        Args:
+            n: Number of readings.
+            dt: Sample period in seconds.
+        Returns:
+            A dict of numpy arrays of length n with the same keys as
+            read_supply_values(), plus "timestamp" in seconds relative to
+            the start of the batch.
+        """
+        voltage, current = self._simulate(n, dt)
+        self.last_read = time.monotonic()
+
+        output = {
+            "timestamp": dt * np.arange(1, n + 1),
+            "output_current": current,
+            "output_voltage": voltage,
+            "state": np.full(n, self.state, dtype=bool),
+            "voltage_value_setting": np.full(n, self.voltage_setting),
+            "maximum_current_setting": np.full(
+                n, self.max_output_current_setting),
+            "maximum_voltage_setting": np.full(
+                n, self.max_output_voltage_setting)
+        }
+        return output
+
+
+class MockPSUDriver(SimulatedPSUDriver):
+    """ Mock driver to be used without the instrument """
+
+    def __init__(self, output_noise_mean, output_noise_std_dev, **load_kwargs):
+        super(MockPSUDriver, self).__init__(
+            output_noise_mean, output_noise_std_dev, **load_kwargs)
+        self.r = redis.StrictRedis.from_url(os.environ['REDIS_URL'])
+        self.__set_redis_defaults()
+
+    def __set_redis_defaults(self):
+        self.r.set('volts', self.voltage_setting)
+        self.r.set('state', str(self.state))
+        self.r.set('resistance', self.resistance)
+        self.r.set('max_curr', self.max_output_current_setting)
+        self.r.set('max_volts', self.max_output_voltage_setting)
+
+    def __load_settings(self):
+        self.voltage_setting = float(self.r.get('volts'))
+        self.state = self.r.get('state') == b"True"
+        self.resistance = float(self.r.get('resistance'))
+        self.load.resistance = self.resistance
+        self.max_output_current_setting = float(self.r.get('max_curr'))
+        self.max_output_voltage_setting = float(self.r.get('max_volts'))
+
+    def set_state(self, state):
+        ret = super(MockPSUDriver, self).set_state(state)
+        self.r.set('state', str(self.state))
+        return ret
+
+    def set_max_output_voltage(self, volts):
+        self.__load_settings()
+        ret = super(MockPSUDriver, self).set_max_output_voltage(volts)
+        self.r.set('max_volts', volts)
+        return ret
+
+    def set_max_output_current(self, curr):
+        ret = super(MockPSUDriver, self).set_max_output_current(curr)
+        self.r.set('max_curr', curr)
+        return ret
+
+    def set_output_voltage(self, volts):
+        self.__load_settings()
+        ret = super(MockPSUDriver, self).set_output_voltage(volts)
+        self.r.set('volts', volts)
+        return ret
+
+    def set_output_current(self, curr):
+        ret = super(MockPSUDriver, self).set_output_current(curr)
+        self.r.set('max_curr', curr)
+        return ret
+
+    def set_load(self, resistance):
+        super(MockPSUDriver, self).set_load(resistance)
+        self.r.set('resistance', resistance)
+
+    def _simulate(self, n, dt):
+        self.__load_settings()
+        return super(MockPSUDriver, self)._simulate(n, dt)
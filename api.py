@@ -0,0 +1,327 @@
+"""
+JSON automation API served next to the dashboard.
+
+POST /api/batch
+    {
+        "setpoints": [{"device": "psu", "state": true, "voltage": 5.0}],
+        "settle": {"tolerance": 0.05, "timeout": 5, "interval": 0.1},
+        "read": ["psu"]
+    }
+
+Setpoints are applied first, then the devices are optionally polled until
+their output settles, then read. "read": true reads every device.
+
+GET /api/sampler
+    Achieved rate and jitter histograms of the fixed-rate sampler.
+
+GET /api/export?format=csv&start=1540000000&end=1540003600&every=10&gzip=1
+    Streams the recorded samples as CSV or NDJSON ("format=ndjson"),
+    between optional start and end times in seconds since the epoch,
+    keeping one sample out of "every", optionally gzip compressed.
+"""
+import math
+import time
+from contextlib import ExitStack
+
+import flask
+
+from recorder import gzip_stream, iter_samples, to_csv, to_ndjson
+
+# Setpoint keys, in the order they are applied, and their driver methods
+SETPOINTS = (
+    ("state", "set_state"),
+    ("max_current", "set_max_output_current"),
+    ("max_voltage", "set_max_output_voltage"),
+    ("voltage", "set_output_voltage"),
+)
+
+DEFAULT_SETTLE = {"tolerance": 0.05, "timeout": 5.0, "interval": 0.1}
+# A batch holds its worker while settling, stay below gunicorn's 30 s
+# worker timeout and do not poll the bus back to back.
+MAX_SETTLE_TIMEOUT = 20.0  # Seconds
+MIN_SETTLE_INTERVAL = 0.1  # Seconds
+
+# Export formats, their encoders and mimetypes
+EXPORT_FORMATS = {
+    "csv": (to_csv, "text/csv"),
+    "ndjson": (to_ndjson, "application/x-ndjson"),
+}
+
+
+class BatchError(Exception):
+    """ Invalid batch request """
+    pass
+
+
+def _transaction(devices, names):
+    # Hold the bus of every device of the group, always in the same order
+    stack = ExitStack()
+    for name in sorted(set(names)):
+        stack.enter_context(devices[name].transaction())
+    return stack
+
+
+def _check_devices(devices, names):
+    if not isinstance(names, list):
+        raise BatchError("Expected a list of device names")
+    for name in names:
+        if not isinstance(name, str) or name not in devices:
+            raise BatchError("Unknown device {}".format(name))
+
+
+def _is_number(value):
+    return (isinstance(value, (int, float)) and
+            not isinstance(value, bool) and math.isfinite(value))
+
+
+def _check_setpoints(devices, setpoints):
+    # Rejects the whole batch before any setpoint reaches a device
+    if not isinstance(setpoints, list):
+        raise BatchError("Expected a list of setpoints")
+    for setpoint in setpoints:
+        if not isinstance(setpoint, dict):
+            raise BatchError("Invalid setpoint {}".format(setpoint))
+        _check_devices(devices, [setpoint.get("device")])
+        if "state" in setpoint and not isinstance(setpoint["state"], bool):
+            raise BatchError("Invalid state {}, expected true or false".format(
+                setpoint["state"]))
+        for key, _ in SETPOINTS[1:]:
+            if key in setpoint and not _is_number(setpoint[key]):
+                raise BatchError("Invalid {} {}".format(key, setpoint[key]))
+
+
+def _settle_options(settle):
+    # Settle options of a batch request merged with the defaults
+    options = dict(DEFAULT_SETTLE)
+    if isinstance(settle, dict):
+        options.update(settle)
+    for key, value in options.items():
+        if key not in DEFAULT_SETTLE:
+            raise BatchError("Unknown settle option {}".format(key))
+        if not _is_number(value) or value < 0:
+            raise BatchError("Invalid settle {} {}".format(key, value))
+    if options["timeout"] > MAX_SETTLE_TIMEOUT:
+        raise BatchError("Settle timeout is limited to {} s".format(
+            MAX_SETTLE_TIMEOUT))
+    if options["interval"] < MIN_SETTLE_INTERVAL:
+        raise BatchError("Settle interval must be at least {} s".format(
+            MIN_SETTLE_INTERVAL))
+    return {key: float(value) for key, value in options.items()}
+
+
+def apply_setpoints(devices, setpoints):
+    """
+    Applies a list of setpoints as one bus transaction group.
+    Args:
+        devices: Dict of device name to SerializedDriver.
+        setpoints: List of dicts with a "device" and setpoint keys.
+    Returns:
+        A list with a result dict per setpoint.
+    """
+    names = [setpoint.get("device") for setpoint in setpoints]
+    _check_devices(devices, names)
+    results = []
+    with _transaction(devices, names):
+        for setpoint in setpoints:
+            driver = devices[setpoint["device"]]
+            result = {"device": setpoint["device"], "ok": True}
+            try:
+                for key, method in SETPOINTS:
+                    if key not in setpoint:
+                        continue
+                    value = setpoint[key]
+                    if key == "state":
+                        driver.set_control(value)
+                    else:
+                        value = float(value)
+                    if not getattr(driver, method)(value):
+                        raise IOError("{} was rejected".format(key))
+            except (ValueError, IOError) as e:
+                result["ok"] = False
+                result["error"] = str(e)
+            results.append(result)
+    return results
+
+
+def read_devices(devices, names):
+    """
+    Reads several devices as one bus transaction group.
+    Args:
+        devices: Dict of device name to SerializedDriver.
+        names: Names of the devices to read.
+    Returns:
+        A dict of device name to value dict, or to {"error": ...}.
+    """
+    _check_devices(devices, names)
+    readings = {}
+    with _transaction(devices, names):
+        for name in names:
+            try:
+                readings[name] = devices[name].read_supply_values()
+            except IOError as e:
+                readings[name] = {"error": str(e)}
+    return readings
+
+
+def wait_settled(devices, setpoints, tolerance, timeout, interval):
+    """
+    Polls the devices of the applied setpoints until their output is stable and
+    at the requested voltage, or the timeout expires.
+    Args:
+        devices: Dict of device name to SerializedDriver.
+        setpoints: List of setpoint dicts that were applied.
+        tolerance: Allowed deviation in Volts and Amps.
+        timeout: Maximum wait in seconds.
+        interval: Seconds between polls.
+    Returns:
+        A dict of device name to a boolean telling if it settled.
+    """
+    targets = {}
+    for setpoint in setpoints:
+        targets.setdefault(setpoint["device"], None)
+        if "voltage" in setpoint:
+            targets[setpoint["device"]] = float(setpoint["voltage"])
+
+    settled = dict.fromkeys(targets, False)
+    previous = {}
+    deadline = time.monotonic() + timeout
+    while True:
+        pending = [name for name in targets if not settled[name]]
+        for name, values in read_devices(devices, pending).items():
+            if "error" in values:
+                continue
+            last = previous.get(name)
+            previous[name] = values
+            if last is None:
+                continue
+            stable = all(
+                abs(float(values[key]) - float(last[key])) <= tolerance
+                for key in ("output_voltage", "output_current"))
+            target = targets[name]
+            on_target = (target is None or not values["state"] or
+                         abs(float(values["output_voltage"]) - target) <=
+                         tolerance)
+            settled[name] = stable and on_target
+        if all(settled.values()) or time.monotonic() >= deadline:
+            return settled
+        time.sleep(interval)
+
+
+def _seconds_to_ns(value):
+    if value is None:
+        return None
+    try:
+        return int(float(value) * 1e9)
+    except (ValueError, OverflowError):
+        raise BatchError("Invalid time {}".format(value))
+
+
+def create_api(devices, on_setpoint=None, recorder_path=None, sampler=None):
+    """
+    Creates the automation API blueprint.
+    Args:
+        devices: Dict of device name to SerializedDriver or
+                 GuardedDriver.
+        on_setpoint: Optional callable(device, setpoint) called after each
+                     successful setpoint, e.g. to update the poller.
+        recorder_path: Optional path of the sample file to export.
+        sampler: Optional FixedRateSampler whose statistics are served.
+    Returns:
+        A flask.Blueprint to register on the server.
+    """
+    api = flask.Blueprint("api", __name__)
+
+    @api.errorhandler(BatchError)
+    def _handle_batch_error(e):
+        return flask.jsonify({"error": str(e)}), 400
+
+    @api.route("/batch", methods=["POST"])
+    def batch():
+        body = flask.request.get_json(silent=True)
+        if not isinstance(body, dict):
+            raise BatchError("Expected a JSON object")
+
+        response = {}
+        setpoints = body.get("setpoints", [])
+        _check_setpoints(devices, setpoints)
+        settle = body.get("settle")
+        if settle:
+            settle = _settle_options(settle)
+        if setpoints:
+            response["setpoints"] = apply_setpoints(devices, setpoints)
+            applied = [
+                setpoint
+                for setpoint, result in zip(setpoints, response["setpoints"])
+                if result["ok"]
+            ]
+            if on_setpoint is not None:
+                for setpoint in applied:
+                    on_setpoint(setpoint["device"], setpoint)
+
+            if settle:
+                response["settled"] = wait_settled(
+                    devices, applied, settle["tolerance"], settle["timeout"],
+                    settle["interval"])
+
+        names = body.get("read", [])
+        if names is True:
+            names = sorted(devices)
+        if names:
+            response["readings"] = read_devices(devices, names)
+        return flask.jsonify(response)
+
+    @api.route("/export", methods=["GET"])
+    def export():
+        if recorder_path is None:
+            raise BatchError("Recording is disabled")
+        args = flask.request.args
+        fmt = args.get("format", "csv")
+        if fmt not in EXPORT_FORMATS:
+            raise BatchError("Unknown format {}".format(fmt))
+        try:
+            every = max(int(args.get("every", 1)), 1)
+        except ValueError:
+            raise BatchError("Invalid decimation {}".format(args["every"]))
+        encoder, mimetype = EXPORT_FORMATS[fmt]
+        start = _seconds_to_ns(args.get("start"))
+        end = _seconds_to_ns(args.get("end"))
+
+        # Fail before the response starts, not in the middle of the stream
+        try:
+            chunks = iter_samples(recorder_path, start, end, every)
+        except FileNotFoundError:
+            return flask.jsonify({"error": "Nothing recorded yet"}), 404
+        except IOError as e:
+            raise BatchError(str(e))
+        stream = encoder(chunks)
+        filename = "telemetry.{}".format(fmt)
+        headers = {}
+        if args.get("gzip") in ("1", "true"):
+            stream = gzip_stream(stream)
+            filename += ".gz"
+            mimetype = "application/gzip"
+        headers["Content-Disposition"] = "attachment; filename={}".format(
+            filename)
+        return flask.Response(
+            flask.stream_with_context(stream),
+            mimetype=mimetype,
+            headers=headers)
+
+    @api.route("/devices", methods=["GET"])
+    def list_devices():
+        return flask.jsonify({"devices": sorted(devices)})
+
+    @api.route("/sampler", methods=["GET"])
+    def sampler_stats():
+        if sampler is None:
+            raise BatchError("Fixed-rate sampling is disabled")
+        return flask.jsonify(sampler.stats())
+
+    @api.route("/health", methods=["GET"])
+    def device_health():
+        return flask.jsonify({
+            name: driver.health.as_dict()
+            for name, driver in devices.items() if hasattr(driver, "health")
+        })
+
+    return api
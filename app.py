@@ -1,22 +1,91 @@
 import argparse
 import json
 import copy
+import fcntl
+import logging
 import os
+import time
 
 import dash
+import flask
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_daq as daq
 
 from dash.dependencies import Input, Output, State
-
-from BKPDriver import SyncBKPDriver
-from MockDriver import MockPSUDriver
-from layout import dark_layout, light_layout, root_layout, external_css
-
-driver = MockPSUDriver(0, 0.01)
-
-app = dash.Dash("power_supply_appa", static_folder='')
+from dash.exceptions import PreventUpdate
+
+from api import create_api
+from driver import SerializedDriver, create_driver
+from health import DeviceHealth, GuardedDriver
+from recorder import SampleRecorder
+from running_stats import OutputStats
+from sampler import FixedRateSampler
+from scheduler import AdaptivePoller
+from layout import dark_layout, light_layout, root_layout, set_logo_urls
+
+# Callbacks and the automation API share serialized access to the bus.
+# The breaker sits in front of the bus lock, so a dead device fails fast.
+health = DeviceHealth()
+driver = GuardedDriver(
+    SerializedDriver(create_driver(os.getenv('PSU_DRIVER', 'mock'))), health)
+
+DEVICE = 'psu'
+devices = {DEVICE: driver}
+poller = AdaptivePoller()
+poller.register(DEVICE, min_interval=500, max_interval=30000)
+
+output_stats = OutputStats(window=100)
+# Last output state commanded per device, None until the first command
+commanded_state = {}
+
+
+def on_state_command(device, state):
+    # The statistics restart whenever a command turns the output on, even
+    # if no reading saw it off in between
+    if state and not commanded_state.get(device):
+        output_stats.reset()
+    commanded_state[device] = state
+
+# With PSU_RECORD_FILE set, every bus reading is appended to that sample
+# file, served by /api/export. The file is not rotated. Move or remove it
+# to start a new recording, the next reading creates a new file.
+RECORD_FILE = os.getenv('PSU_RECORD_FILE')
+recorder = SampleRecorder(RECORD_FILE) if RECORD_FILE else None
+
+
+# Feeds a reading to the poller, the output statistics and the recording
+def ingest(values, monotonic=None, timestamp_ns=None):
+    poller.update(DEVICE, values)
+    output_stats.update(values,
+                        time.monotonic() if monotonic is None else monotonic)
+    if recorder is not None:
+        recorder.append(values, timestamp_ns)
+
+
+# With PSU_SAMPLE_RATE (Hz) set, readings come from a fixed-rate sampler
+# instead of the browser intervals. The sampler runs in a single process,
+# so serve the app with exactly one gunicorn worker (WEB_CONCURRENCY=1):
+# other workers would have no readings to show.
+SAMPLE_RATE = float(os.getenv('PSU_SAMPLE_RATE', 0))
+SAMPLER_LOCK_FILE = os.getenv('PSU_SAMPLER_LOCK', 'sampler.lock')
+sampler = None
+sampler_lock = None
+if SAMPLE_RATE:
+    sampler = FixedRateSampler(
+        driver,
+        SAMPLE_RATE,
+        on_sample=lambda sample: ingest(sample, sample["monotonic_ns"] / 1e9,
+                                        sample["timestamp_ns"]))
+
+# Fingerprinted assets and component bundles are cached for a year
+ASSET_MAX_AGE = 31536000
+
+app = dash.Dash(
+    "power_supply_appa",
+    static_folder='',
+    compress=True,
+    components_cache_max_age=ASSET_MAX_AGE)
 
 if 'DYNO' in os.environ:
     if bool(os.getenv('DASH_PATH_ROUTING', 0)):
@@ -24,12 +93,72 @@ if 'DYNO' in os.environ:
             os.environ['DASH_APP_NAME']
         )
 
+set_logo_urls(app)
+
 app.layout = root_layout
 
 app.config['supress_callback_exceptions'] = True
 server = app.server
-for css in external_css:
-    app.css.append_css({"external_url": css})
+
+# Serve the component bundles and stylesheets from this server instead of
+# the CDN so they are compressed and cached with the app.
+app.css.config.serve_locally = True
+app.scripts.config.serve_locally = True
+
+# Dash serves component bundles as "application/JavaScript", which the
+# default Flask-Compress mimetypes do not match.
+server.config['COMPRESS_MIMETYPES'] = [
+    'text/html', 'text/css', 'text/xml', 'application/json',
+    'application/javascript', 'application/JavaScript'
+]
+
+
+def on_api_setpoint(device, setpoint):
+    poller.notify_setpoint(device)
+    if "state" in setpoint:
+        on_state_command(device, setpoint["state"])
+
+
+server.register_blueprint(
+    create_api(devices, on_api_setpoint, RECORD_FILE, sampler),
+    url_prefix='/api')
+
+
+def start_sampler():
+    """
+    Starts the fixed-rate sampler, called by gunicorn's post_fork hook as
+    threads do not survive the preload fork. An exclusive lock on
+    SAMPLER_LOCK_FILE, held until the process exits, keeps other worker
+    processes from sampling the bus too.
+    Returns:
+        True if the sampler runs in this process.
+    """
+    global sampler_lock
+    if sampler is None or sampler_lock is not None:
+        return sampler_lock is not None
+    lock = open(SAMPLER_LOCK_FILE, 'a')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError:
+        lock.close()
+        logging.getLogger().warning(
+            "Sampler already runs in another process, this one has no "
+            "readings to serve")
+        return False
+    sampler_lock = lock
+    sampler.start()
+    return True
+
+
+@server.after_request
+def cache_fingerprinted_assets(response):
+    if ('m' in flask.request.args
+            and '/assets/' in flask.request.path
+            and response.status_code == 200):
+        response.cache_control.public = True
+        response.cache_control.max_age = ASSET_MAX_AGE
+    return response
+
 
 default_layout = root_layout
 
@@ -56,14 +185,14 @@ def update_page(value):
 @app.callback(
     Output('output-voltage', 'value'), [Input('store-data', 'children')])
 def update_output_voltage(input):
-    values = driver.read_supply_values()
+    values = json.loads(input)
     return "{:04.2f}".format(float(values["output_voltage"]))
 
 
 @app.callback(
     Output('output-current', 'value'), [Input('store-data', 'children')])
 def update_output_current(input):
-    values = driver.read_supply_values()
+    values = json.loads(input)
     return "{:04.2f}".format(float(values["output_current"]))
 
 
@@ -77,10 +206,72 @@ def update_max_voltage(input):
 @app.callback(
     Output('max-current', 'value'), [Input('store-data', 'children')])
 def update_max_current(input):
-    values = driver.read_supply_values()
+    values = json.loads(input)
     return "{:04.2f}".format(float(values["maximum_current_setting"]))
 
 
+@app.callback(
+    Output('store-stats', 'children'), [Input('store-data', 'children')])
+def update_stats(_):
+    return json.dumps(output_stats.snapshot())
+
+
+@app.callback(
+    Output('avg-voltage', 'value'), [Input('store-stats', 'children')])
+def update_avg_voltage(input):
+    stats = json.loads(input)
+    return "{:04.2f}".format(stats["voltage"]["mean"])
+
+
+@app.callback(
+    Output('avg-current', 'value'), [Input('store-stats', 'children')])
+def update_avg_current(input):
+    stats = json.loads(input)
+    return "{:04.2f}".format(stats["current"]["mean"])
+
+
+@app.callback(Output('energy', 'value'), [Input('store-stats', 'children')])
+def update_energy(input):
+    stats = json.loads(input)
+    return "{:04.2f}".format(stats["energy"])
+
+
+@app.callback(Output('charge', 'value'), [Input('store-stats', 'children')])
+def update_charge(input):
+    stats = json.loads(input)
+    return "{:04.2f}".format(stats["charge"])
+
+
+@app.callback(
+    Output('stats-detail', 'children'), [Input('store-stats', 'children')])
+def update_stats_detail(input):
+    stats = json.loads(input)
+    if not stats["voltage"]["count"]:
+        return ""
+    detail = "{} min {min:.3f} max {max:.3f} std {std_dev:.3f}"
+    return " | ".join([
+        detail.format("V", **stats["voltage"]),
+        detail.format("I", **stats["current"])
+    ])
+
+
+@app.callback(
+    Output('health-status', 'children'),
+    [Input('output-update', 'n_intervals'),
+     Input('store-data', 'children')])
+def update_health_status(_1, _2):
+    status = health.as_dict()
+    if status["state"] == DeviceHealth.OK:
+        return ""
+    if status["last_success"] is None:
+        last_reply = "no reply yet"
+    else:
+        last_reply = "last reply {:.0f}s ago".format(
+            time.time() - status["last_success"])
+    return "Device degraded ({}): {} consecutive failures, {}".format(
+        status["state"], status["consecutive_failures"], last_reply)
+
+
 @app.callback(Output('submit', 'disabled'), [Input('status', 'value')])
 def update_button(status):
     return not status
@@ -88,9 +279,14 @@ def update_button(status):
 
 @app.callback(Output('status', 'value'), [Input('on-button', 'on')])
 def on_power(input):
-    values = driver.read_supply_values()
-    driver.set_control(str(input))
-    ret = driver.set_state(str(input))
+    try:
+        driver.set_control(str(input))
+        ret = driver.set_state(str(input))
+    except IOError:
+        return not input
+    poller.notify_setpoint(DEVICE)
+    if ret:
+        on_state_command(DEVICE, bool(input))
     return input if ret else not input
 
 
@@ -99,10 +295,33 @@ def on_power(input):
     [Input('output-update', 'n_intervals'),
      Input('status', 'value')])
 def fetch_data(_1, _2):
-    values = driver.read_supply_values()
+    if sampler is not None:
+        # The sampler owns the bus, serve its latest sample
+        values = poller.last_values(DEVICE)
+        if values is None:
+            raise PreventUpdate
+        return json.dumps(values)
+    # Sessions share the device reading until its polling interval elapses
+    if not poller.is_due(DEVICE):
+        return json.dumps(poller.last_values(DEVICE))
+    try:
+        values = driver.read_supply_values()
+    except IOError:
+        # Keep showing the last reading while the device is degraded
+        values = poller.last_values(DEVICE)
+        if values is None:
+            raise PreventUpdate
+        return json.dumps(values)
+    ingest(values)
     return json.dumps(values)
 
 
+@app.callback(
+    Output('output-update', 'interval'), [Input('store-data', 'children')])
+def update_interval(_):
+    return poller.interval(DEVICE)
+
+
 @app.callback(Output('submit', 'children'), [Input('choice', 'value')])
 def on_choice_update(value):
     return "Set {}".format(value)
@@ -125,7 +344,7 @@ def on_value_maybe_error(
             driver.set_max_output_current(value)
         elif choice == "Max Voltage":
             driver.set_max_output_voltage(value)
-    except ValueError as e:
+    except (ValueError, IOError) as e:
         print(e)
         return "Error: {}".format(str(e))
     return ""
@@ -144,7 +363,7 @@ def on_value_maybe_show_error(_, value, choice):
             driver.set_max_output_current(value)
         elif choice == "Max Voltage":
             driver.set_max_output_voltage(value)
-    except ValueError as e:
+    except (ValueError, IOError) as e:
         return False
     return True
 
@@ -158,16 +377,22 @@ def on_value_update(
         value,
         choice,
 ):
-    value = float(value)
-    if choice == "Voltage":
-        driver.set_output_voltage(value)
-    elif choice == "Max Current":
-        driver.set_max_output_current(value)
-    elif choice == "Max Voltage":
-        driver.set_max_output_voltage(value)
+    try:
+        value = float(value)
+        if choice == "Voltage":
+            driver.set_output_voltage(value)
+        elif choice == "Max Current":
+            driver.set_max_output_current(value)
+        elif choice == "Max Voltage":
+            driver.set_max_output_voltage(value)
+    except (ValueError, IOError):
+        # Reported by the error label callbacks
+        raise PreventUpdate
+    poller.notify_setpoint(DEVICE)
 
     return 0
 
 
 if __name__ == '__main__':
+    start_sampler()
     app.run_server(debug=False)
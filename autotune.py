@@ -0,0 +1,418 @@
+"""
+Serial link auto-tuning and capability probing of the BK Precision PSU.
+
+Finds the highest stable baud rate, the smallest inter-frame gap the device
+accepts and its turnaround time and per-command latency, and saves them as
+a device profile used by SyncBKPDriver:
+
+    python autotune.py --port /dev/ttyUSB0 --address 0
+    python autotune.py --simulate --turnaround 0.02 --max-baudrate 38400
+"""
+import argparse
+import json
+import os
+import struct
+import time
+from collections import defaultdict
+
+import serial
+
+from BKPDriver import SyncBKPDriver
+from MockDriver import SimulatedPSUDriver
+
+BAUDRATES = (115200, 57600, 38400, 19200, 9600, 4800)
+GAPS = (0, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05)  # Seconds
+PROBE_TIMEOUT = 1.0  # Seconds
+PROBE_GAP = 0.05  # Seconds
+PROBE_READS = 20
+TIMEOUT_SAFETY_FACTOR = 3
+DEFAULT_PROFILE_PATH = 'device_profile.json'
+
+
+def frame_time(baudrate, size=SyncBKPDriver.FRAME_SIZE):
+    """
+    Returns the time in seconds to transfer a frame, 10 bits per byte.
+    """
+    return size * 10.0 / baudrate
+
+
+class TimingTransport(object):
+    """ Transport proxy timing every exchange of a driver """
+
+    def __init__(self, factory, baudrate):
+        """
+        Args:
+            factory: Callable returning a serial-like context manager.
+            baudrate: Baud rate of the link, to take the transfer time of
+                      the frames out of the turnaround.
+        """
+        self.factory = factory
+        self.baudrate = baudrate
+        self.turnarounds = []
+        self.latencies = defaultdict(list)
+
+    def __call__(self):
+        return _TimedLink(self, self.factory())
+
+
+class _TimedLink(object):
+    def __init__(self, timing, link):
+        self.timing = timing
+        self.link = link
+
+    def __enter__(self):
+        self.link = self.link.__enter__() or self.link
+        return self
+
+    def __exit__(self, *args):
+        return self.link.__exit__(*args)
+
+    def write(self, data):
+        self.cmd = data[2]
+        self.size = len(data)
+        written = self.link.write(data)
+        self.sent = time.perf_counter()
+        return written
+
+    def read(self, size=1):
+        first = self.link.read(1)
+        if not first:
+            return first
+        # write() returns before the request is on the wire, and the first
+        # byte is only read once fully received
+        baudrate = self.timing.baudrate
+        transfer = frame_time(baudrate, self.size) + frame_time(baudrate, 1)
+        self.timing.turnarounds.append(
+            max(time.perf_counter() - self.sent - transfer, 0))
+        rest = self.link.read(size - 1)
+        self.timing.latencies[self.cmd].append(time.perf_counter() -
+                                               self.sent)
+        return first + rest
+
+
+def _exercise(driver, reads):
+    # A stable link answers every read and a status command
+    try:
+        if not driver.set_control(True):
+            return False
+        for _ in range(reads):
+            driver.read_supply_values()
+    except IOError:
+        return False
+    return True
+
+
+def probe(open_link, address, baudrates=BAUDRATES, reads=PROBE_READS):
+    """
+    Probes a device for the fastest stable link settings.
+    Args:
+        open_link: Callable(baudrate, timeout) returning a serial-like
+                   context manager.
+        address: Address of the device.
+        baudrates: Baud rates to try, fastest first.
+        reads: Reads per trial.
+    Returns:
+        A profile dict with the "baudrate", the reply "timeout", the
+        "inter_frame_gap" and the measured "turnaround" in seconds, the
+        mean "latency" per command and the "probed_at" time.
+    """
+
+    def make_driver(baudrate, gap):
+        # Each trial starts on a quiet link, whatever the previous trial or
+        # user of the link left behind
+        time.sleep(PROBE_GAP)
+        timing = TimingTransport(lambda: open_link(baudrate, PROBE_TIMEOUT),
+                                 baudrate)
+        driver = SyncBKPDriver(
+            baudrate,
+            address,
+            transport=timing,
+            profile={
+                "timeout": PROBE_TIMEOUT,
+                "inter_frame_gap": gap
+            })
+        return driver, timing
+
+    for baudrate in baudrates:
+        driver, timing = make_driver(baudrate, PROBE_GAP)
+        if _exercise(driver, reads):
+            break
+    else:
+        raise IOError("No stable baud rate found for device {}".format(
+            address))
+
+    for gap in GAPS:
+        if gap >= PROBE_GAP:
+            break
+        candidate, candidate_timing = make_driver(baudrate, gap)
+        if _exercise(candidate, reads):
+            timing = candidate_timing
+            break
+    else:
+        gap = PROBE_GAP
+
+    worst = max(max(values) for values in timing.latencies.values())
+    return {
+        "baudrate": baudrate,
+        "timeout": TIMEOUT_SAFETY_FACTOR * worst,
+        "inter_frame_gap": gap,
+        "turnaround": max(timing.turnarounds),
+        "latency": {
+            "0x{:02X}".format(cmd): sum(values) / len(values)
+            for cmd, values in timing.latencies.items()
+        },
+        "probed_at": time.time(),
+    }
+
+
+def profile_key(port, address):
+    return "{}:{}".format(port, address)
+
+
+def load_profile(path, key):
+    """
+    Loads a device profile.
+    Args:
+        path: Path of the profile file.
+        key: Key of the device, see profile_key().
+    Returns:
+        The profile dict, or None if the device was never probed.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f).get(key)
+
+
+def save_profile(path, key, profile):
+    """
+    Saves a device profile, keeping the profiles of other devices.
+    Args:
+        path: Path of the profile file.
+        key: Key of the device, see profile_key().
+        profile: Profile dict returned by probe().
+    """
+    profiles = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            profiles = json.load(f)
+    profiles[key] = profile
+    tmp_path = "{}.tmp".format(path)
+    with open(tmp_path, "w") as f:
+        json.dump(profiles, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def tuned_driver(port,
+                 address,
+                 baudrate=9600,
+                 profile_path=DEFAULT_PROFILE_PATH,
+                 probe_missing=False,
+                 **kwargs):
+    """
+    Creates a SyncBKPDriver using the saved profile of the device.
+    Args:
+        port: Serial port of the device.
+        address: Address of the device.
+        baudrate: Baud rate used when no profile exists.
+        profile_path: Path of the profile file.
+        probe_missing: Probe and save a profile when none exists.
+        kwargs: Other SyncBKPDriver arguments.
+    Returns:
+        The driver.
+    """
+    key = profile_key(port, address)
+    profile = load_profile(profile_path, key)
+    if profile is None and probe_missing:
+        profile = probe(
+            lambda baud, timeout: serial.Serial(port, baud, timeout=timeout),
+            address)
+        save_profile(profile_path, key, profile)
+    return SyncBKPDriver(baudrate, address, port, profile=profile, **kwargs)
+
+
+class SimulatedInstrument(object):
+    """
+    BK Precision protocol simulator with configurable link behaviour.
+    Frames above max_baudrate are corrupted, and requests arriving less
+    than min_gap after the previous reply are ignored.
+    """
+
+    def __init__(self,
+                 address=0,
+                 turnaround=0.01,
+                 max_baudrate=38400,
+                 min_gap=0.0,
+                 psu=None):
+        """
+        Args:
+            address: Address the instrument answers to.
+            turnaround: Seconds between the end of a request and the
+                        start of the reply.
+            max_baudrate: Highest baud rate the link transfers reliably.
+            min_gap: Minimum quiet time in seconds between frames.
+            psu: Simulated supply behind the protocol, one is created
+                 otherwise.
+        """
+        self.address = address
+        self.turnaround = turnaround
+        self.max_baudrate = max_baudrate
+        self.min_gap = min_gap
+        self.psu = psu or SimulatedPSUDriver(0, 0.001)
+        self.last_reply = 0
+
+    def open(self, baudrate, timeout=None):
+        """
+        Returns a serial-like link to the instrument.
+        """
+        return _SimulatedLink(self, baudrate, timeout)
+
+    def __frame(self, cmd, payload):
+        frame = bytearray(SyncBKPDriver.FRAME_SIZE)
+        frame[0] = 0xAA
+        frame[1] = self.address
+        frame[2] = cmd
+        frame[3:3 + len(payload)] = payload
+        frame[-1] = sum(frame[:-1]) % 256
+        return bytes(frame)
+
+    def __status(self, code):
+        return self.__frame(SyncBKPDriver.STATUS_FRAME, [code])
+
+    def __values(self):
+        values = self.psu.read_supply_values()
+
+        def fixed(value, limit):
+            return min(max(int(round(value * 1000)), 0), limit)
+
+        payload = struct.pack(
+            "<HIBHII", fixed(values["output_current"], 0xFFFF),
+            fixed(values["output_voltage"], 0xFFFFFFFF),
+            1 if values["state"] else 0,
+            fixed(values["maximum_current_setting"], 0xFFFF),
+            fixed(values["maximum_voltage_setting"], 0xFFFFFFFF),
+            fixed(values["voltage_value_setting"], 0xFFFFFFFF))
+        return self.__frame(0x26, payload)
+
+    def handle(self, request):
+        """
+        Executes a request frame.
+        Args:
+            request: The request bytes.
+        Returns:
+            The reply frame, or None when the instrument stays silent.
+        """
+        if (len(request) != SyncBKPDriver.FRAME_SIZE or request[0] != 0xAA
+                or request[1] != self.address):
+            return None
+        if sum(request[:-1]) % 256 != request[-1]:
+            return self.__status(SyncBKPDriver.CHECKSUM_INCORRECT)
+
+        cmd = request[2]
+        value = struct.unpack("<I", bytes(request[3:7]))[0] / 1000.0
+        try:
+            if cmd == 0x20:
+                self.psu.set_control(request[3] == 1)
+            elif cmd == 0x21:
+                self.psu.set_state("True" if request[3] == 1 else "False")
+            elif cmd == 0x22:
+                self.psu.set_max_output_voltage(value)
+            elif cmd == 0x23:
+                self.psu.set_output_voltage(value)
+            elif cmd == 0x24:
+                self.psu.set_max_output_current(value)
+            elif cmd == 0x26:
+                return self.__values()
+            else:
+                return self.__status(SyncBKPDriver.INVALID_CMD)
+        except ValueError:
+            return self.__status(SyncBKPDriver.PARAM_INCORRECT)
+        return self.__status(SyncBKPDriver.SUCCESS)
+
+
+class _SimulatedLink(object):
+    def __init__(self, instrument, baudrate, timeout):
+        self.instrument = instrument
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.reply = b""
+        self.byte_time = frame_time(baudrate, 1)
+        self.first_byte_at = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def write(self, data):
+        instrument = self.instrument
+        now = time.monotonic()
+        data = bytes(data)
+        reply = None
+        if now - instrument.last_reply >= instrument.min_gap:
+            reply = instrument.handle(data)
+        if reply is not None and self.baudrate > instrument.max_baudrate:
+            # Framing errors flip bits all over the frame
+            reply = bytes(byte ^ 0x55 for byte in reply)
+        self.reply = reply or b""
+        self.first_byte_at = (now + frame_time(self.baudrate, len(data)) +
+                              instrument.turnaround + self.byte_time)
+        return len(data)
+
+    def read(self, size=1):
+        if not self.reply:
+            time.sleep(self.timeout or 0)
+            return b""
+        size = min(size, len(self.reply))
+        ready_at = self.first_byte_at + (size - 1) * self.byte_time
+        delay = ready_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        data, self.reply = self.reply[:size], self.reply[size:]
+        self.first_byte_at = ready_at + self.byte_time
+        if not self.reply:
+            self.instrument.last_reply = time.monotonic()
+        return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--port', help="Serial port of the device")
+    parser.add_argument('--address', type=int, default=0)
+    parser.add_argument('--profile', default=DEFAULT_PROFILE_PATH)
+    parser.add_argument(
+        '--simulate',
+        action='store_true',
+        help="Probe a simulated instrument instead of the serial port")
+    parser.add_argument('--turnaround', type=float, default=0.01)
+    parser.add_argument('--max-baudrate', type=int, default=38400)
+    parser.add_argument('--min-gap', type=float, default=0.0)
+    args = parser.parse_args()
+
+    if args.simulate:
+        instrument = SimulatedInstrument(args.address, args.turnaround,
+                                         args.max_baudrate, args.min_gap)
+        profile = probe(instrument.open, args.address)
+        print(json.dumps(profile, indent=2, sort_keys=True))
+        expected = max(baud for baud in BAUDRATES if baud <= args.max_baudrate)
+        if (profile["baudrate"] != expected
+                or profile["inter_frame_gap"] < args.min_gap):
+            raise SystemExit(
+                "Probed {} baud with a {} s gap, expected {} baud and at "
+                "least {} s".format(profile["baudrate"],
+                                    profile["inter_frame_gap"], expected,
+                                    args.min_gap))
+        return
+
+    if not args.port:
+        parser.error("--port is required unless --simulate is given")
+    profile = probe(
+        lambda baud, timeout: serial.Serial(args.port, baud, timeout=timeout),
+        args.address)
+    save_profile(args.profile, profile_key(args.port, args.address), profile)
+    print(json.dumps(profile, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
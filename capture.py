@@ -0,0 +1,251 @@
+"""
+Capture and replay of the serial traffic of the BK Precision PSU.
+
+A capture file starts with a header followed by one record per frame:
+
+    header: magic "BKPC", format version (uint16), wall clock start (uint64 ns)
+    record: monotonic offset from start (uint64 ns), direction (uint8),
+            frame length (uint8), frame bytes
+
+    python capture.py dump capture.bkp
+    python capture.py bench capture.bkp --reads 100000
+"""
+import argparse
+import struct
+import time
+from threading import Lock
+
+MAGIC = b"BKPC"
+VERSION = 1
+HEADER = struct.Struct("<4sHQ")
+RECORD = struct.Struct("<QBB")
+
+REQUEST = 0
+REPLY = 1
+
+
+def _monotonic_ns():
+    if hasattr(time, "perf_counter_ns"):
+        return time.perf_counter_ns()
+    return int(time.perf_counter() * 1e9)
+
+
+def _wall_ns():
+    if hasattr(time, "time_ns"):
+        return time.time_ns()
+    return int(time.time() * 1e9)
+
+
+class CaptureWriter(object):
+    """ Thread safe writer recording serial frames to a capture file """
+
+    def __init__(self, path):
+        self.path = path
+        self.start = _monotonic_ns()
+        self.__lock = Lock()
+        # Unbuffered writes of whole records, so nothing is left in a
+        # buffer that a forked worker process would inherit and flush again.
+        self.__file = open(path, "wb", buffering=0)
+        self.__file.write(HEADER.pack(MAGIC, VERSION, _wall_ns()))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def record(self, direction, frame):
+        """
+        Appends a frame to the capture.
+        Args:
+            direction: REQUEST or REPLY.
+            frame: The bytes sent or received.
+        """
+        timestamp = _monotonic_ns() - self.start
+        frame = bytes(frame)
+        data = RECORD.pack(timestamp, direction, len(frame)) + frame
+        with self.__lock:
+            self.__file.write(data)
+
+    def close(self):
+        with self.__lock:
+            self.__file.close()
+
+
+def read_capture(path):
+    """
+    Reads the frames of a capture file.
+    Args:
+        path: Path of the capture file.
+    Returns:
+        A generator of (timestamp_ns, direction, frame) tuples, with the
+        timestamp relative to the start of the capture.
+    """
+    with open(path, "rb") as f:
+        magic, version, _ = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise IOError("{} is not a BKPC v{} capture".format(
+                path, VERSION))
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return
+            timestamp, direction, length = RECORD.unpack(head)
+            yield timestamp, direction, f.read(length)
+
+
+def read_exchanges(path):
+    """
+    Pairs the requests of a capture file with their replies.
+    Args:
+        path: Path of the capture file.
+    Returns:
+        A list of (request, reply, turnaround_ns) tuples. Requests that
+        got no reply have an empty reply.
+    """
+    exchanges = []
+    pending = None
+    for timestamp, direction, frame in read_capture(path):
+        if direction == REQUEST:
+            if pending is not None:
+                exchanges.append((pending[1], b"", 0))
+            pending = (timestamp, frame)
+        elif pending is not None:
+            exchanges.append((pending[1], frame, timestamp - pending[0]))
+            pending = None
+    if pending is not None:
+        exchanges.append((pending[1], b"", 0))
+    return exchanges
+
+
+class ReplayTransport(object):
+    """
+    Serial transport feeding captured replies back to a driver.
+    Instances are passed as the transport factory of SyncBKPDriver.
+    """
+
+    def __init__(self, path, speed=1.0, strict=False, loop=False):
+        """
+        Args:
+            path: Path of the capture file.
+            speed: Factor applied to the captured turnaround times,
+                   None to reply as fast as possible.
+            strict: Require the requests to match the capture byte for
+                    byte. Otherwise the next reply to the same command is
+                    used.
+            loop: Restart from the beginning when the capture runs out.
+        """
+        self.exchanges = read_exchanges(path)
+        self.speed = speed
+        self.strict = strict
+        self.loop = loop
+        self.position = 0
+        self.__reply = b""
+
+    @property
+    def address(self):
+        """
+        Device address of the first captured request, or None.
+        """
+        return self.exchanges[0][0][1] if self.exchanges else None
+
+    def __call__(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def __find(self, data):
+        count = len(self.exchanges)
+        limit = count if self.loop else count - self.position
+        for offset in range(limit):
+            index = (self.position + offset) % count
+            request = self.exchanges[index][0]
+            if self.strict:
+                if request != data:
+                    raise IOError(
+                        "Replay diverged from the capture at exchange {}".
+                        format(index))
+                return index
+            if request[1:3] == data[1:3]:  # Address and command
+                return index
+        return None
+
+    def write(self, data):
+        data = bytes(data)
+        index = self.__find(data) if self.exchanges else None
+        if index is None:
+            self.__reply = b""
+            return len(data)
+        _, self.__reply, turnaround = self.exchanges[index]
+        self.position = index + 1
+        if self.loop:
+            self.position %= len(self.exchanges)
+        if self.speed:
+            time.sleep(turnaround / 1e9 / self.speed)
+        return len(data)
+
+    def read(self, size=1):
+        reply, self.__reply = self.__reply[:size], self.__reply[size:]
+        return reply
+
+
+def dump(path):
+    for timestamp, direction, frame in read_capture(path):
+        print("{:>14.6f} {} {}".format(timestamp / 1e9,
+                                       "->" if direction == REQUEST else "<-",
+                                       frame.hex()))
+
+
+def bench(path, reads, speed=None):
+    """
+    Decodes captured replies through the driver as fast as possible.
+    Args:
+        path: Path of the capture file.
+        reads: Number of read_supply_values() calls.
+        speed: Replay speed, None for as fast as possible.
+    Returns:
+        Reads per second.
+    """
+    from BKPDriver import SyncBKPDriver
+
+    transport = ReplayTransport(path, speed=speed, loop=True)
+    if not any(request[2] == 0x26 and reply
+               for request, reply, _ in transport.exchanges):
+        raise IOError("{} contains no read replies".format(path))
+    driver = SyncBKPDriver(None, transport.address, transport=transport)
+    start = time.perf_counter()
+    for _ in range(reads):
+        driver.read_supply_values()
+    return reads / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    subparsers = parser.add_subparsers(dest="command")
+    dump_parser = subparsers.add_parser("dump")
+    dump_parser.add_argument("path")
+    bench_parser = subparsers.add_parser("bench")
+    bench_parser.add_argument("path")
+    bench_parser.add_argument("--reads", type=int, default=10000)
+    bench_parser.add_argument(
+        "--speed",
+        type=float,
+        default=None,
+        help="Replay speed, 1 for real time (default: as fast as possible)")
+    args = parser.parse_args()
+
+    if args.command == "dump":
+        dump(args.path)
+    elif args.command == "bench":
+        print("{:.1f} reads/s".format(bench(args.path, args.reads,
+                                            args.speed)))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
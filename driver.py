@@ -1,4 +1,7 @@
 from abc import ABCMeta, abstractmethod
+from contextlib import contextmanager
+from threading import RLock
+import os
 
 
 class GenericPSUDriver(ABCMeta):
@@ -25,3 +28,81 @@ class GenericPSUDriver(ABCMeta):
     @abstractmethod
     def read_supply_values(self):
         raise NotImplementedError
+
+
+class SerializedDriver(object):
+    """ Driver proxy serializing every call to the wrapped driver """
+
+    def __init__(self, driver, lock=None):
+        """
+        Args:
+            driver: Driver to wrap.
+            lock: Optional RLock shared by the drivers of the same bus.
+        """
+        self.driver = driver
+        self.lock = lock or RLock()
+
+    def __getattr__(self, name):
+        attr = getattr(self.driver, name)
+        if not callable(attr):
+            return attr
+
+        def serialized(*args, **kwargs):
+            with self.lock:
+                return attr(*args, **kwargs)
+
+        return serialized
+
+    @contextmanager
+    def transaction(self):
+        """
+        Holds the bus for a group of calls, so no other caller can
+        interleave requests with them.
+        """
+        with self.lock:
+            yield self
+
+
+def create_driver(kind='mock'):
+    """
+    Creates a PSU driver configured from the environment.
+    Args:
+        kind: One of
+            "mock": MockPSUDriver backed by REDIS_URL.
+            "simulated": In-memory SimulatedPSUDriver.
+            "replay": SyncBKPDriver replaying the capture PSU_REPLAY_FILE.
+            "serial": SyncBKPDriver on PSU_SERIAL_PORT at PSU_BAUDRATE
+                      (default 9600) and PSU_ADDRESS (default 0), tuned
+                      with its saved profile from PSU_PROFILE_FILE. With
+                      PSU_AUTOTUNE set, a missing profile is probed.
+            "subscriber": TelemetrySubscriber reading the telemetry of an
+                          acquisition node through REDIS_URL.
+    Returns:
+        The driver.
+    """
+    if kind == 'mock':
+        from MockDriver import MockPSUDriver
+        return MockPSUDriver(0, 0.01)
+    elif kind == 'simulated':
+        from MockDriver import SimulatedPSUDriver
+        return SimulatedPSUDriver(0, 0.01)
+    elif kind == 'replay':
+        from BKPDriver import SyncBKPDriver
+        from capture import ReplayTransport
+        replay = ReplayTransport(os.environ['PSU_REPLAY_FILE'], loop=True)
+        return SyncBKPDriver(None, replay.address, transport=replay)
+    elif kind == 'serial':
+        from autotune import DEFAULT_PROFILE_PATH, tuned_driver
+        return tuned_driver(
+            os.environ['PSU_SERIAL_PORT'],
+            int(os.getenv('PSU_ADDRESS', 0)),
+            int(os.getenv('PSU_BAUDRATE', 9600)),
+            os.getenv('PSU_PROFILE_FILE', DEFAULT_PROFILE_PATH),
+            probe_missing=bool(os.getenv('PSU_AUTOTUNE')),
+            capture_path=os.getenv('PSU_CAPTURE_FILE'))
+    elif kind == 'subscriber':
+        import redis
+        from telemetry import TelemetrySubscriber
+        return TelemetrySubscriber(
+            redis.StrictRedis.from_url(os.environ['REDIS_URL']))
+    raise ValueError("Unknown driver {}".format(kind))
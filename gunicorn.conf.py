@@ -0,0 +1,10 @@
+"""
+Gunicorn settings of the dashboard, see the Procfile.
+"""
+
+
+def post_fork(server, worker):
+    # Starts the fixed-rate sampler as soon as a worker is forked, instead
+    # of on its first request
+    from app import start_sampler
+    start_sampler()
@@ -0,0 +1,141 @@
+import time
+from threading import Lock
+
+
+class DeviceUnavailable(IOError):
+    """ Raised without touching the bus while a device's breaker is open """
+    pass
+
+
+class DeviceHealth(object):
+    """ Thread safe health tracking and circuit breaker of one device """
+
+    # Breaker states
+    OK = "ok"
+    FAILED = "failed"
+    PROBING = "probing"
+
+    # properties
+    DEFAULT_FAILURE_THRESHOLD = 3  # Consecutive failures opening the breaker
+    DEFAULT_PROBE_INTERVAL = 10.0  # Seconds between recovery probes
+    LATENCY_SMOOTHING = 0.2  # Weight of the latest call in the average
+
+    def __init__(self,
+                 failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+                 probe_interval=DEFAULT_PROBE_INTERVAL):
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.state = self.OK
+        self.consecutive_failures = 0
+        self.last_success = None
+        self.last_error = None
+        self.latency = None
+        self.__opened_at = None
+        self.__lock = Lock()
+
+    def allow(self):
+        """
+        Checks whether a call may go to the device. Once the breaker is
+        open, a single probe is let through every probe interval.
+        Returns:
+            True if the call may proceed.
+        """
+        with self.__lock:
+            if self.state == self.OK:
+                return True
+            if (self.state == self.FAILED and time.monotonic() -
+                    self.__opened_at >= self.probe_interval):
+                self.state = self.PROBING
+                return True
+            return False
+
+    def record_success(self, latency):
+        """
+        Records a successful call, closing the breaker.
+        Args:
+            latency: Duration of the call in seconds.
+        """
+        with self.__lock:
+            self.state = self.OK
+            self.consecutive_failures = 0
+            self.last_success = time.time()
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += self.LATENCY_SMOOTHING * (
+                    latency - self.latency)
+
+    def record_failure(self, error):
+        """
+        Records a failed call, opening the breaker after too many
+        consecutive failures or a failed probe.
+        Args:
+            error: The exception raised by the call.
+        """
+        with self.__lock:
+            self.consecutive_failures += 1
+            self.last_error = str(error)
+            if (self.state == self.PROBING or
+                    self.consecutive_failures >= self.failure_threshold):
+                self.state = self.FAILED
+                self.__opened_at = time.monotonic()
+
+    def cancel_probe(self):
+        """
+        Reopens the breaker when a probe ended without reaching the bus,
+        so the next call probes again.
+        """
+        with self.__lock:
+            if self.state == self.PROBING:
+                self.state = self.FAILED
+
+    def as_dict(self):
+        with self.__lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "last_success": self.last_success,
+                "last_error": self.last_error,
+                "latency": self.latency,
+            }
+
+
+class GuardedDriver(object):
+    """ Driver proxy tracking the health of the device behind a breaker """
+
+    def __init__(self, driver, health=None):
+        """
+        Args:
+            driver: Driver to wrap, typically a SerializedDriver.
+            health: Optional DeviceHealth, one is created otherwise.
+        """
+        self.driver = driver
+        self.health = health or DeviceHealth()
+
+    def transaction(self):
+        return self.driver.transaction()
+
+    def __getattr__(self, name):
+        attr = getattr(self.driver, name)
+        if not callable(attr):
+            return attr
+
+        def guarded(*args, **kwargs):
+            if not self.health.allow():
+                raise DeviceUnavailable(
+                    "Device unavailable after {} failures: {}".format(
+                        self.health.consecutive_failures,
+                        self.health.last_error))
+            start = time.monotonic()
+            try:
+                result = attr(*args, **kwargs)
+            except IOError as e:
+                self.health.record_failure(e)
+                raise
+            except Exception:
+                self.health.cancel_probe()
+                raise
+            self.health.record_success(time.monotonic() - start)
+            return result
+
+        return guarded
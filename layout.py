@@ -2,10 +2,47 @@ import dash
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_daq as daq
-import base64
+import os
+
+
+LIGHT_LOGO = 'dash-daq-logo-by-plotly-stripe.png'
+DARK_LOGO = 'dash-daq-logo-by-plotly-stripe-dark.png'
+
+
+def asset_url(app, filename):
+    """
+    Returns the fingerprinted URL of a file in the assets folder.
+    Args:
+        app: The Dash app, whose pathname prefix must be configured.
+        filename: Path of the file relative to the assets folder.
+    Returns:
+        The URL with the modification time appended, so the file can be
+        cached until it changes.
+    """
+    modified = int(os.path.getmtime(os.path.join('assets', filename)))
+    return '{}?m={}'.format(app.get_asset_url(filename), modified)
+
+
+logo_style = {
+    'position': 'relative',
+    'float': 'right',
+    'right': '10px',
+    'height': '75px'
+}
+light_logo = html.Img(style=logo_style)
+dark_logo = html.Img(style=logo_style)
+
+
+def set_logo_urls(app):
+    """
+    Points the header logos at their fingerprinted asset URLs.
+    Args:
+        app: The Dash app, whose pathname prefix must be configured.
+    """
+    light_logo.src = asset_url(app, LIGHT_LOGO)
+    dark_logo.src = asset_url(app, DARK_LOGO)
+
 
-logo_path = 'dash-daq-logo-by-plotly-stripe.png'
-img = base64.b64encode(open(logo_path, 'rb').read())
 light_header = html.Div(
     [
         html.H5(
@@ -17,17 +54,7 @@ light_header = html.Div(
                 'display': 'inline-block',
                 'text-align': 'center'
             }),
-        html.A(
-            html.Img(
-                src="https://s3-us-west-1.amazonaws.com/plotly-tutorials/" +
-                "excel/dash-daq/dash-daq-logo-by-plotly-stripe.png",
-                style={
-                    'position': 'relative',
-                    'float': 'right',
-                    'right': '10px',
-                    'height': '75px'
-                }),
-            href='https://www.dashdaq.io')
+        html.A(light_logo, href='https://www.dashdaq.io')
     ],
     className='banner',
     style={
@@ -48,16 +75,7 @@ dark_header = html.Div(children=[
                     'display': 'inline-block',
                     'text-align': 'center'
                 }),
-            html.Img(
-                src="https://s3-us-west-1.amazonaws.com/plotly-" +
-                "tutorials/excel/dash-daq/dash-daq-logo-by-" +
-                "plotly-stripe+copy.png",
-                style={
-                    'position': 'relative',
-                    'float': 'right',
-                    'right': '10px',
-                    'height': '75px'
-                })
+            dark_logo
         ],
         className='banner',
         style={
@@ -148,6 +166,34 @@ top_box = html.Div([
             daq.LEDDisplay(
                 id="max-current", className="three columns", color="#4ADE00")
         ]),
+    html.Div(
+        className="row",
+        children=[
+            html.Label(children="Average Voltage", className="three columns"),
+            html.Label(children="Average Current", className="three columns"),
+            html.Label(children="Energy (J)", className="three columns"),
+            html.Label(children="Charge (C)", className="three columns"),
+        ],
+    ),
+    html.Div(
+        className="row",
+        children=[
+            daq.LEDDisplay(
+                id="avg-voltage", className="three columns", color="#4ADE00"),
+            daq.LEDDisplay(
+                id="avg-current", className="three columns", color="#4ADE00"),
+            daq.LEDDisplay(
+                id="energy", className="three columns", color="#4ADE00"),
+            daq.LEDDisplay(
+                id="charge", className="three columns", color="#4ADE00")
+        ]),
+    html.Div(
+        id="stats-detail",
+        className="row",
+        style={
+            "padding": "10px 0px",
+            "text-align": "center"
+        }),
 ])
 
 bottom_box = [
@@ -215,7 +261,13 @@ bottom_box = [
         id='error-label',
         style=error_label_style,
         hidden=True,
-    )
+    ),
+    html.Label(
+        id='health-status',
+        style={
+            "text-align": "center",
+            "color": "#EF553B"
+        }),
 ]
 
 dark_top_box = html.Div(
@@ -257,9 +309,10 @@ light_layout = html.Div(
 
 root_layout = html.Div(
     [
-        dcc.Interval(id='output-update', interval=3e6, n_intervals=0),
+        dcc.Interval(id='output-update', interval=500, n_intervals=0),
         html.Div([daq.Indicator(id='status', value=False)], hidden=True),
         html.Div(id="store-data", hidden=True),
+        html.Div(id="store-stats", hidden=True),
         dcc.Location(id='url', refresh=False),
         html.Div(
             [
@@ -287,10 +340,3 @@ root_layout = html.Div(
     ],
     style={"height": "100vh"})
 
-external_css = [
-    "https://cdnjs.cloudflare.com/ajax/libs/normalize/7.0.0/normalize.min.css",
-    "skeleton.css", "//fonts.googleapis.com/css?family=Raleway:400,300,600",
-    "https://maxcdn.bootstrapcdn.com/font-awesome/4.7.0/css/font-awesome.min.css",
-    "https://codepen.io/chriddyp/pen/brPBPO.css",
-    "https://cdn.rawgit.com/plotly/dash-app-stylesheets/2cc54b8c03f4126569a3440aae611bbef1d7a5dd/stylesheet.css"
-]
@@ -0,0 +1,412 @@
+"""
+Load-test harness for the power supply dashboard.
+
+Simulates concurrent Dash sessions firing the same callback requests the
+browser sends, and reports throughput, callback latency percentiles and
+driver calls per client tick.
+
+    python loadtest.py --clients 20 --duration 30 --save baseline.json
+    python loadtest.py --clients 20 --duration 30 --compare baseline.json
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+
+class CountingDriver(object):
+    """ Driver proxy counting the calls made to the wrapped driver """
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.calls = defaultdict(int)
+        self.__lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attr = getattr(self.driver, name)
+        if not callable(attr):
+            return attr
+
+        def counted(*args, **kwargs):
+            with self.__lock:
+                self.calls[name] += 1
+            return attr(*args, **kwargs)
+
+        return counted
+
+    def total_calls(self):
+        with self.__lock:
+            return sum(self.calls.values())
+
+
+# Transports return None when a callback raised PreventUpdate, which Dash
+# answers with an empty 204: the request succeeded without an update.
+
+
+class LocalTransport(object):
+    """ Posts callback requests to the in-process Flask server """
+
+    def __init__(self, server, prefix):
+        self.client = server.test_client()
+        self.url = '{}_dash-update-component'.format(prefix)
+
+    def post(self, payload):
+        reply = self.client.post(
+            self.url,
+            data=json.dumps(payload),
+            content_type='application/json')
+        if reply.status_code == 204:
+            return None
+        if reply.status_code != 200:
+            raise IOError("Callback failed with status {}".format(
+                reply.status_code))
+        return json.loads(reply.get_data(as_text=True))
+
+
+class HTTPTransport(object):
+    """ Posts callback requests to a running server over HTTP """
+
+    def __init__(self, url):
+        import requests
+        self.session = requests.Session()
+        self.url = '{}/_dash-update-component'.format(url.rstrip('/'))
+
+    def post(self, payload):
+        reply = self.session.post(self.url, json=payload)
+        reply.raise_for_status()
+        if reply.status_code == 204:
+            return None
+        return reply.json()
+
+
+def _prop(component_id, prop, value=None):
+    return {"id": component_id, "property": prop, "value": value}
+
+
+def _request(output_id, output_prop, inputs, state=None):
+    return {
+        "output": {
+            "id": output_id,
+            "property": output_prop
+        },
+        "inputs": inputs,
+        "state": state or [],
+    }
+
+
+class Session(object):
+    """ One simulated operator session """
+
+    STORE_OUTPUTS = [
+        ('output-voltage', 'value'),
+        ('output-current', 'value'),
+        ('max-voltage', 'value'),
+        ('max-current', 'value'),
+        ('output-update', 'interval'),
+        ('store-stats', 'children'),
+    ]
+    STATS_OUTPUTS = [
+        ('avg-voltage', 'value'),
+        ('avg-current', 'value'),
+        ('energy', 'value'),
+        ('charge', 'value'),
+        ('stats-detail', 'children'),
+    ]
+    SUBMIT_OUTPUTS = [
+        ('error-label', 'children'),
+        ('error-label', 'hidden'),
+        ('output-update', 'n_intervals'),
+    ]
+
+    def __init__(self, transport, results):
+        self.transport = transport
+        self.results = results
+        self.n_intervals = 0
+        self.n_clicks = 0
+        self.dark = False
+
+    def __call(self, name, payload):
+        # Returns None on errors and when the callback did not update, so
+        # the callbacks chained on its output are not fired
+        start = time.perf_counter()
+        try:
+            reply = self.transport.post(payload)
+        except Exception:
+            self.results.error(name)
+            return None
+        self.results.record(name, time.perf_counter() - start)
+        return reply
+
+    def tick(self):
+        """
+        Fires the store-data and store-stats chains and the health status
+        triggered by one interval tick.
+        """
+        self.n_intervals += 1
+        reply = self.__call(
+            'store-data',
+            _request('store-data', 'children', [
+                _prop('output-update', 'n_intervals', self.n_intervals),
+                _prop('status', 'value', True)
+            ]))
+        if reply is None:
+            return
+        data = reply["response"]["props"]["children"]
+        replies = {}
+        for output_id, output_prop in self.STORE_OUTPUTS:
+            replies[output_id] = self.__call(
+                output_id,
+                _request(output_id, output_prop,
+                         [_prop('store-data', 'children', data)]))
+        self.__call(
+            'health-status',
+            _request('health-status', 'children', [
+                _prop('output-update', 'n_intervals', self.n_intervals),
+                _prop('store-data', 'children', data)
+            ]))
+        if replies['store-stats'] is None:
+            return
+        stats = replies['store-stats']["response"]["props"]["children"]
+        for output_id, output_prop in self.STATS_OUTPUTS:
+            self.__call(
+                output_id,
+                _request(output_id, output_prop,
+                         [_prop('store-stats', 'children', stats)]))
+
+    def submit(self, value=5.0, choice="Voltage"):
+        """
+        Fires the callbacks triggered by the set button.
+        """
+        self.n_clicks += 1
+        for output_id, output_prop in self.SUBMIT_OUTPUTS:
+            self.__call(
+                'submit',
+                _request(output_id, output_prop,
+                         [_prop('submit', 'n_clicks', self.n_clicks)], [
+                             _prop('set-value', 'value', value),
+                             _prop('choice', 'value', choice)
+                         ]))
+
+    def toggle_theme(self):
+        """
+        Fires the callbacks triggered by the theme toggle.
+        """
+        self.dark = not self.dark
+        for output_prop in ('children', 'style'):
+            self.__call(
+                'theme',
+                _request('content', output_prop,
+                         [_prop('toggle-theme', 'value', self.dark)]))
+
+
+class Results(object):
+    """ Thread safe collector of callback latencies """
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.ticks = 0
+        self.__lock = threading.Lock()
+
+    def record(self, name, latency):
+        with self.__lock:
+            self.latencies[name].append(latency)
+
+    def error(self, name):
+        with self.__lock:
+            self.errors[name] += 1
+
+    def tick(self):
+        with self.__lock:
+            self.ticks += 1
+
+    def summary(self, elapsed, driver_calls=None):
+        """
+        Summarizes the run.
+        Args:
+            elapsed: Duration of the run in seconds.
+            driver_calls: Total driver calls, or None when unknown.
+        Returns:
+            A JSON serializable dict.
+        """
+        with self.__lock:
+            everything = np.concatenate(
+                [np.asarray(v) for v in self.latencies.values()] or
+                [np.zeros(0)])
+            summary = {
+                "elapsed": elapsed,
+                "requests": int(everything.size),
+                "errors": int(sum(self.errors.values())),
+                "requests_per_sec": everything.size / elapsed,
+                "ticks": self.ticks,
+                "latency_ms": _percentiles(everything),
+                "callbacks": {
+                    name: dict(
+                        _percentiles(np.asarray(values)),
+                        count=len(values),
+                        errors=self.errors.get(name, 0))
+                    for name, values in self.latencies.items()
+                },
+            }
+        if driver_calls is not None:
+            summary["driver_calls"] = driver_calls
+            summary["driver_calls_per_tick"] = (
+                float(driver_calls) / self.ticks if self.ticks else 0.0)
+        return summary
+
+
+def _percentiles(latencies):
+    if not latencies.size:
+        return {}
+    p50, p90, p95, p99 = np.percentile(latencies * 1000, [50, 90, 95, 99])
+    return {
+        "p50": p50,
+        "p90": p90,
+        "p95": p95,
+        "p99": p99,
+        "max": float(latencies.max() * 1000),
+    }
+
+
+def run(make_transport,
+        clients,
+        duration,
+        tick_interval=0,
+        submit_every=0,
+        theme_every=0):
+    """
+    Runs concurrent sessions for a fixed duration.
+    Args:
+        make_transport: Callable creating one transport per session.
+        clients: Number of concurrent sessions.
+        duration: Duration of the run in seconds.
+        tick_interval: Delay between ticks of a session in seconds,
+                       0 to saturate the server.
+        submit_every: Fire the submit flow every n ticks, 0 to disable.
+        theme_every: Toggle the theme every n ticks, 0 to disable.
+    Returns:
+        Tuple of the Results and the elapsed time in seconds.
+    """
+    results = Results()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        session = Session(make_transport(), results)
+        while time.perf_counter() < deadline:
+            session.tick()
+            results.tick()
+            if submit_every and session.n_intervals % submit_every == 0:
+                session.submit()
+            if theme_every and session.n_intervals % theme_every == 0:
+                session.toggle_theme()
+            if tick_interval:
+                time.sleep(tick_interval)
+
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+def compare(summary, baseline, tolerance):
+    """
+    Compares a run against a saved baseline.
+    Args:
+        summary: Summary of the current run.
+        baseline: Summary of the baseline run.
+        tolerance: Allowed relative regression, e.g. 0.2 for 20%.
+    Returns:
+        A list of regression messages, empty when none were found.
+    """
+    regressions = []
+    if summary["requests_per_sec"] < (
+            baseline["requests_per_sec"] * (1 - tolerance)):
+        regressions.append("requests/sec dropped from {:.1f} to {:.1f}".format(
+            baseline["requests_per_sec"], summary["requests_per_sec"]))
+    for key in ("p50", "p95", "p99"):
+        old = baseline["latency_ms"].get(key)
+        new = summary["latency_ms"].get(key)
+        if old and new and new > old * (1 + tolerance):
+            regressions.append("{} latency rose from {:.2f}ms to {:.2f}ms".
+                               format(key, old, new))
+    old = baseline.get("driver_calls_per_tick")
+    new = summary.get("driver_calls_per_tick")
+    if old is not None and new is not None and new > old * (1 + tolerance):
+        regressions.append("driver calls per tick rose from {:.2f} to {:.2f}".
+                           format(old, new))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--clients', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument(
+        '--tick-interval',
+        type=float,
+        default=0,
+        help="Seconds between ticks of a session, 0 to saturate")
+    parser.add_argument('--submit-every', type=int, default=0)
+    parser.add_argument('--theme-every', type=int, default=0)
+    parser.add_argument(
+        '--driver',
+        choices=['mock', 'simulated', 'replay', 'subscriber'],
+        default='simulated')
+    parser.add_argument(
+        '--replay-file', help="Capture file used by the replay driver")
+    parser.add_argument(
+        '--url', help="Target a running server instead of app.server")
+    parser.add_argument('--save', help="Write the results to a JSON file")
+    parser.add_argument('--compare', help="Baseline JSON file to compare to")
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    counter = None
+    if args.url:
+        make_transport = lambda: HTTPTransport(args.url)
+    else:
+        os.environ['PSU_DRIVER'] = args.driver
+        if args.replay_file:
+            os.environ['PSU_REPLAY_FILE'] = args.replay_file
+        import app
+        counter = app.driver = CountingDriver(app.driver)
+        prefix = app.app.config.routes_pathname_prefix
+        make_transport = lambda: LocalTransport(app.server, prefix)
+
+    results, elapsed = run(make_transport, args.clients, args.duration,
+                           args.tick_interval, args.submit_every,
+                           args.theme_every)
+    summary = results.summary(elapsed, counter and counter.total_calls())
+    summary["config"] = {
+        "clients": args.clients,
+        "duration": args.duration,
+        "tick_interval": args.tick_interval,
+        "submit_every": args.submit_every,
+        "theme_every": args.theme_every,
+        "driver": None if args.url else args.driver,
+    }
+    print(json.dumps(summary, indent=2, sort_keys=True))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(summary, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION: {}".format(regression), file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+"""
+Append-only store of PSU readings and streaming exports of it.
+
+The file starts with a header (magic "BKPS", format version) followed by
+fixed-size little endian records in the order they were recorded, so a
+time range is found by bisection and read in chunks of constant size.
+"""
+import json
+import os
+import struct
+import time
+import zlib
+from threading import Lock
+
+import numpy as np
+
+MAGIC = b"BKPS"
+VERSION = 1
+HEADER = struct.Struct("<4sH")
+
+FIELDS = (
+    "timestamp_ns",
+    "output_voltage",
+    "output_current",
+    "state",
+    "voltage_value_setting",
+    "maximum_current_setting",
+    "maximum_voltage_setting",
+)
+RECORD = np.dtype([
+    ("timestamp_ns", "<i8"),
+    ("output_voltage", "<f8"),
+    ("output_current", "<f8"),
+    ("state", "u1"),
+    ("voltage_value_setting", "<f8"),
+    ("maximum_current_setting", "<f8"),
+    ("maximum_voltage_setting", "<f8"),
+])
+
+CHUNK_SIZE = 4096  # Records read at once
+
+
+def _wall_ns():
+    if hasattr(time, "time_ns"):
+        return time.time_ns()
+    return int(time.time() * 1e9)
+
+
+class SampleRecorder(object):
+    """ Thread safe writer appending readings to a sample file """
+
+    def __init__(self, path):
+        self.path = path
+        self.__lock = Lock()
+        self.__open()
+
+    def __open(self):
+        # Unbuffered appends keep each record a single write, so readers
+        # and other worker processes never see a partial record.
+        self.__file = open(self.path, "ab", buffering=0)
+        if self.__file.tell() == 0:
+            self.__file.write(HEADER.pack(MAGIC, VERSION))
+
+    def __reopen_if_moved(self):
+        # A moved or removed file is replaced by a new one at the path
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            st = None
+        current = os.fstat(self.__file.fileno())
+        if (st is None or st.st_ino != current.st_ino
+                or st.st_dev != current.st_dev):
+            self.__file.close()
+            self.__open()
+
+    def append(self, values, timestamp_ns=None):
+        """
+        Appends a reading.
+        Args:
+            values: Value dict returned by read_supply_values().
+            timestamp_ns: Wall clock time of the reading in ns, defaults
+                          to now.
+        """
+        record = np.zeros(1, dtype=RECORD)
+        record["timestamp_ns"] = (_wall_ns()
+                                  if timestamp_ns is None else timestamp_ns)
+        for field in FIELDS[1:]:
+            record[field] = float(values[field])
+        data = record.tobytes()
+        with self.__lock:
+            self.__reopen_if_moved()
+            self.__file.write(data)
+
+    def close(self):
+        with self.__lock:
+            self.__file.close()
+
+
+def _open(path):
+    f = open(path, "rb")
+    header = f.read(HEADER.size)
+    if (len(header) < HEADER.size
+            or HEADER.unpack(header) != (MAGIC, VERSION)):
+        f.close()
+        raise IOError("{} is not a BKPS v{} sample file".format(
+            path, VERSION))
+    return f
+
+
+def _timestamp_at(f, index):
+    f.seek(HEADER.size + index * RECORD.itemsize)
+    return struct.unpack("<q", f.read(8))[0]
+
+
+def _bisect(f, count, timestamp_ns):
+    # Index of the first record at or after timestamp_ns
+    low, high = 0, count
+    while low < high:
+        middle = (low + high) // 2
+        if _timestamp_at(f, middle) < timestamp_ns:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def iter_samples(path, start_ns=None, end_ns=None, every=1,
+                 chunk_size=CHUNK_SIZE):
+    """
+    Reads the recorded samples in chunks. The file is opened and checked
+    and the time range is located at once, so errors are raised before
+    the first chunk is read.
+    Args:
+        path: Path of the sample file.
+        start_ns: Optional first timestamp to include, in ns.
+        end_ns: Optional timestamp to stop before, in ns.
+        every: Keep one sample out of every n.
+        chunk_size: Records read at once.
+    Returns:
+        A generator of numpy record arrays of dtype RECORD.
+    Raises:
+        IOError if the file is missing or is not a sample file.
+    """
+    f = _open(path)
+    try:
+        count = (os.fstat(f.fileno()).st_size - HEADER.size) // RECORD.itemsize
+        first = 0 if start_ns is None else _bisect(f, count, start_ns)
+        last = count if end_ns is None else _bisect(f, count, end_ns)
+    except Exception:
+        f.close()
+        raise
+    # Read whole multiples of the decimation so it stays aligned
+    chunk_size = max(chunk_size // every, 1) * every
+    return _read_chunks(f, first, last, every, chunk_size)
+
+
+def _read_chunks(f, first, last, every, chunk_size):
+    with f:
+        f.seek(HEADER.size + first * RECORD.itemsize)
+        index = first
+        while index < last:
+            n = min(chunk_size, last - index)
+            chunk = np.frombuffer(f.read(n * RECORD.itemsize), dtype=RECORD)
+            index += n
+            if every > 1:
+                chunk = chunk[::every]
+            if len(chunk):
+                yield chunk
+
+
+def to_csv(chunks):
+    """
+    Formats sample chunks as CSV.
+    Args:
+        chunks: Generator of record arrays from iter_samples().
+    Returns:
+        A generator of CSV text blocks, starting with the header row.
+    """
+    yield ",".join(FIELDS) + "\n"
+    for chunk in chunks:
+        yield "".join(
+            "{},{!r},{!r},{},{!r},{!r},{!r}\n".format(
+                int(r[0]), float(r[1]), float(r[2]), int(r[3]), float(r[4]),
+                float(r[5]), float(r[6])) for r in chunk.tolist())
+
+
+def to_ndjson(chunks):
+    """
+    Formats sample chunks as newline delimited JSON.
+    Args:
+        chunks: Generator of record arrays from iter_samples().
+    Returns:
+        A generator of NDJSON text blocks.
+    """
+    for chunk in chunks:
+        yield "".join(
+            json.dumps(dict(zip(FIELDS, r[:3] + (bool(r[3]), ) + r[4:]))) +
+            "\n" for r in chunk.tolist())
+
+
+def gzip_stream(blocks, level=6):
+    """
+    Gzip compresses a stream of text blocks incrementally.
+    Args:
+        blocks: Generator of text blocks.
+        level: Compression level.
+    Returns:
+        A generator of compressed byte blocks.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for block in blocks:
+        data = compressor.compress(block.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,209 @@
+import math
+from collections import deque
+from threading import Lock
+
+
+class RunningStats(object):
+    """ O(1) per sample mean, variance, min and max (Welford) """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, x):
+        """
+        Adds a sample.
+        Args:
+            x: Sample value.
+        """
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        self.min = x if self.min is None else min(self.min, x)
+        self.max = x if self.max is None else max(self.max, x)
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std_dev(self):
+        return math.sqrt(self.variance)
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "std_dev": self.std_dev,
+            "min": self.min,
+            "max": self.max,
+        }
+
+
+class WindowedStats(RunningStats):
+    """ Running statistics over the last `size` samples """
+
+    def __init__(self, size):
+        if size < 2:
+            raise ValueError("Window must hold at least 2 samples")
+        self.size = size
+        super(WindowedStats, self).__init__()
+
+    def reset(self):
+        super(WindowedStats, self).reset()
+        self.samples = deque()
+        # Monotonic queues of (index, value) for O(1) amortized min and max
+        self.__mins = deque()
+        self.__maxs = deque()
+        self.__index = 0
+
+    def add(self, x):
+        """
+        Adds a sample, evicting the oldest one once the window is full.
+        Args:
+            x: Sample value.
+        """
+        if len(self.samples) == self.size:
+            old = self.samples.popleft()
+            delta = old - self.mean
+            self.mean -= delta / (self.count - 1)
+            self.m2 -= delta * (old - self.mean)
+            self.count -= 1
+        self.samples.append(x)
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 = max(self.m2 + delta * (x - self.mean), 0.0)
+
+        first = self.__index - len(self.samples) + 1
+        while self.__mins and self.__mins[-1][1] >= x:
+            self.__mins.pop()
+        while self.__maxs and self.__maxs[-1][1] <= x:
+            self.__maxs.pop()
+        self.__mins.append((self.__index, x))
+        self.__maxs.append((self.__index, x))
+        while self.__mins[0][0] < first:
+            self.__mins.popleft()
+        while self.__maxs[0][0] < first:
+            self.__maxs.popleft()
+        self.__index += 1
+        self.min = self.__mins[0][1]
+        self.max = self.__maxs[0][1]
+
+
+class EnergyAccumulator(object):
+    """ Trapezoidal integration of delivered energy and charge """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.energy = 0.0  # Joules
+        self.charge = 0.0  # Coulombs
+        self.elapsed = 0.0  # Seconds
+        self.__last = None
+
+    def add(self, timestamp, volts, amps):
+        """
+        Integrates a sample.
+        Args:
+            timestamp: Sample time in seconds.
+            volts: Output voltage.
+            amps: Output current.
+        """
+        if self.__last is not None:
+            last_time, last_volts, last_amps = self.__last
+            dt = timestamp - last_time
+            if dt > 0:
+                self.energy += 0.5 * (last_volts * last_amps +
+                                      volts * amps) * dt
+                self.charge += 0.5 * (last_amps + amps) * dt
+                self.elapsed += dt
+        self.__last = (timestamp, volts, amps)
+
+
+class OutputStats(object):
+    """ Thread safe statistics of the supply output since it turned on """
+
+    def __init__(self, window=None):
+        """
+        Args:
+            window: Optional number of samples of the windowed statistics.
+        """
+        self.window = window
+        self.voltage = RunningStats()
+        self.current = RunningStats()
+        self.energy = EnergyAccumulator()
+        if window:
+            self.windowed_voltage = WindowedStats(window)
+            self.windowed_current = WindowedStats(window)
+        self.state = False
+        self.__lock = Lock()
+
+    def __reset(self):
+        self.voltage.reset()
+        self.current.reset()
+        self.energy.reset()
+        if self.window:
+            self.windowed_voltage.reset()
+            self.windowed_current.reset()
+
+    def reset(self):
+        """
+        Clears the statistics, e.g. when the output state is set.
+        """
+        with self.__lock:
+            self.__reset()
+
+    def update(self, values, timestamp):
+        """
+        Adds a reading. The statistics restart when the output turns on
+        and are not accumulated while it is off.
+        Args:
+            values: Value dict returned by read_supply_values().
+            timestamp: Time of the reading in seconds.
+        """
+        state = bool(values["state"])
+        volts = float(values["output_voltage"])
+        amps = float(values["output_current"])
+        with self.__lock:
+            if state and not self.state:
+                self.__reset()
+            self.state = state
+            if not state:
+                return
+            self.voltage.add(volts)
+            self.current.add(amps)
+            self.energy.add(timestamp, volts, amps)
+            if self.window:
+                self.windowed_voltage.add(volts)
+                self.windowed_current.add(amps)
+
+    def snapshot(self):
+        """
+        Returns:
+            A dict with the voltage and current statistics, the energy in
+            Joules, the charge in Coulombs and the integration time in
+            seconds, plus the windowed statistics when enabled.
+        """
+        with self.__lock:
+            snapshot = {
+                "voltage": self.voltage.as_dict(),
+                "current": self.current.as_dict(),
+                "energy": self.energy.energy,
+                "charge": self.energy.charge,
+                "elapsed": self.energy.elapsed,
+            }
+            if self.window:
+                snapshot["window"] = {
+                    "voltage": self.windowed_voltage.as_dict(),
+                    "current": self.windowed_current.as_dict(),
+                }
+            return snapshot
@@ -0,0 +1,160 @@
+import bisect
+import logging
+import threading
+import time
+
+from running_stats import RunningStats
+
+# Histogram bin edges in microseconds, the last bin is open ended
+JITTER_EDGES_US = (0, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+
+
+def _monotonic_ns():
+    if hasattr(time, "monotonic_ns"):
+        return time.monotonic_ns()
+    return int(time.monotonic() * 1e9)
+
+
+def _wall_ns():
+    if hasattr(time, "time_ns"):
+        return time.time_ns()
+    return int(time.time() * 1e9)
+
+
+class Histogram(object):
+    """ Fixed bin histogram with running moments """
+
+    def __init__(self, edges):
+        self.edges = edges
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * len(self.edges)
+        self.stats = RunningStats()
+
+    def add(self, x):
+        index = max(bisect.bisect_right(self.edges, x) - 1, 0)
+        self.counts[index] += 1
+        self.stats.add(x)
+
+    def as_dict(self):
+        return dict(
+            self.stats.as_dict(), edges=list(self.edges), counts=self.counts)
+
+
+class FixedRateSampler(object):
+    """
+    Reads a driver on an absolute monotonic timeline. Each deadline is
+    start + k * period, so the time spent in I/O does not accumulate as
+    drift, and slots that could not be served are skipped and counted.
+    """
+
+    def __init__(self, driver, rate, on_sample=None):
+        """
+        Args:
+            driver: Driver to read.
+            rate: Target sampling rate in Hz.
+            on_sample: Optional callable receiving each sample.
+        """
+        if rate <= 0:
+            raise ValueError("Sampling rate must be positive")
+        self.driver = driver
+        self.rate = rate
+        self.period_ns = int(1e9 / rate)
+        self.on_sample = on_sample
+        self.logger = logging.getLogger()
+        self.latest = None
+        self.__lock = threading.Lock()
+        self.__running = False
+        self.__thread = None
+        self.__reset_stats()
+
+    def __reset_stats(self):
+        self.samples = 0
+        self.missed = 0
+        self.errors = 0
+        self.started_ns = None
+        self.lateness = Histogram(JITTER_EDGES_US)
+        self.spacing_error = Histogram(JITTER_EDGES_US)
+        self.__last_sample_ns = None
+
+    def __sample(self, deadline_ns):
+        start_ns = _monotonic_ns()
+        try:
+            values = self.driver.read_supply_values()
+        except IOError as e:
+            with self.__lock:
+                self.errors += 1
+            self.logger.debug("Sampling failed: %s", e)
+            return
+        sample = dict(values)
+        sample["timestamp_ns"] = _wall_ns()
+        sample["monotonic_ns"] = start_ns
+        with self.__lock:
+            self.samples += 1
+            self.lateness.add((start_ns - deadline_ns) / 1e3)
+            if self.__last_sample_ns is not None:
+                spacing = start_ns - self.__last_sample_ns
+                self.spacing_error.add(abs(spacing - self.period_ns) / 1e3)
+            self.__last_sample_ns = start_ns
+            self.latest = sample
+        if self.on_sample is not None:
+            self.on_sample(sample)
+
+    def run(self):
+        """
+        Samples until stop() is called.
+        """
+        self.__running = True
+        origin = _monotonic_ns()
+        with self.__lock:
+            self.started_ns = origin
+        slot = 0
+        while self.__running:
+            deadline = origin + slot * self.period_ns
+            delay = deadline - _monotonic_ns()
+            if delay > 0:
+                time.sleep(delay / 1e9)
+            self.__sample(deadline)
+            # Skip the slots that passed while reading
+            elapsed_slots = (_monotonic_ns() - origin) // self.period_ns + 1
+            next_slot = max(slot + 1, elapsed_slots)
+            with self.__lock:
+                self.missed += next_slot - slot - 1
+            slot = next_slot
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.run)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        self.__running = False
+        if self.__thread is not None:
+            self.__thread.join()
+
+    def reset_stats(self):
+        with self.__lock:
+            self.__reset_stats()
+            self.started_ns = _monotonic_ns()
+
+    def stats(self):
+        """
+        Returns:
+            A dict with the target and achieved rates in Hz, the sample,
+            missed slot and error counts, and histograms in microseconds
+            of the lateness of each read against its deadline and of the
+            deviation of the spacing between reads from the period.
+        """
+        with self.__lock:
+            elapsed = ((_monotonic_ns() - self.started_ns) / 1e9
+                       if self.started_ns is not None else 0)
+            return {
+                "target_rate": self.rate,
+                "achieved_rate": self.samples / elapsed if elapsed else 0.0,
+                "samples": self.samples,
+                "missed": self.missed,
+                "errors": self.errors,
+                "lateness_us": self.lateness.as_dict(),
+                "spacing_error_us": self.spacing_error.as_dict(),
+            }
@@ -0,0 +1,126 @@
+import time
+from threading import Lock
+
+
+class AdaptivePoller(object):
+    """ Thread safe adaptive polling scheduler for bus devices """
+
+    # properties
+    DEFAULT_MIN_INTERVAL = 500  # ms
+    DEFAULT_MAX_INTERVAL = 30000  # ms
+    DEFAULT_BACKOFF = 2.0
+    DEFAULT_TOLERANCE = 0.01  # Volts / Amps
+    DEFAULT_BURST = 5  # Fast polls after a setpoint change
+
+    def __init__(self,
+                 backoff=DEFAULT_BACKOFF,
+                 tolerance=DEFAULT_TOLERANCE,
+                 burst=DEFAULT_BURST):
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.burst = burst
+        self.devices = {}
+        self.__lock = Lock()
+
+    def register(self, device, min_interval=None, max_interval=None):
+        """
+        Registers a device with its own polling rate bounds.
+        Args:
+            device: Name of the device.
+            min_interval: Fastest allowed polling interval in ms.
+            max_interval: Slowest allowed polling interval in ms.
+        """
+        min_interval = min_interval or self.DEFAULT_MIN_INTERVAL
+        max_interval = max_interval or self.DEFAULT_MAX_INTERVAL
+        if min_interval > max_interval:
+            raise ValueError("Minimum interval exceeds maximum interval")
+        with self.__lock:
+            self.devices[device] = {
+                "min_interval": min_interval,
+                "max_interval": max_interval,
+                "interval": min_interval,
+                "burst": self.burst,
+                "last_poll": None,
+                "last_values": None,
+            }
+
+    def __device(self, device):
+        if device not in self.devices:
+            raise KeyError("Unknown device {}".format(device))
+        return self.devices[device]
+
+    def __is_moving(self, previous, values):
+        if previous is None or previous["state"] != values["state"]:
+            return True
+        for key in ("output_voltage", "output_current"):
+            if abs(float(values[key]) - float(previous[key])) > self.tolerance:
+                return True
+        return False
+
+    def notify_setpoint(self, device):
+        """
+        Switches a device to fast polling after a setpoint or state change.
+        Args:
+            device: Name of the device.
+        """
+        with self.__lock:
+            dev = self.__device(device)
+            dev["interval"] = dev["min_interval"]
+            dev["burst"] = self.burst
+            dev["last_poll"] = None
+
+    def is_due(self, device):
+        """
+        Checks whether the bus should be read for a device.
+        Args:
+            device: Name of the device.
+        Returns:
+            True if the current interval has elapsed since the last poll.
+        """
+        with self.__lock:
+            dev = self.__device(device)
+            if dev["last_poll"] is None or dev["last_values"] is None:
+                return True
+            elapsed = (time.monotonic() - dev["last_poll"]) * 1000
+            return elapsed >= dev["interval"]
+
+    def last_values(self, device):
+        """
+        Returns the last reading recorded for a device, or None.
+        """
+        with self.__lock:
+            return self.__device(device)["last_values"]
+
+    def update(self, device, values):
+        """
+        Records a fresh reading and computes the next polling interval.
+        Polling stays at the minimum interval while a burst is pending or
+        the readings are moving, and backs off exponentially when they are
+        stable or the output is off.
+        Args:
+            device: Name of the device.
+            values: Value dict returned by read_supply_values().
+        Returns:
+            The next polling interval in ms.
+        """
+        with self.__lock:
+            dev = self.__device(device)
+            moving = self.__is_moving(dev["last_values"], values)
+            if dev["burst"] > 0:
+                dev["burst"] -= 1
+                dev["interval"] = dev["min_interval"]
+            elif moving and values["state"]:
+                dev["interval"] = dev["min_interval"]
+            else:
+                dev["interval"] = min(dev["interval"] * self.backoff,
+                                      dev["max_interval"])
+            dev["last_poll"] = time.monotonic()
+            dev["last_values"] = values
+            return dev["interval"]
+
+    def interval(self, device):
+        """
+        Returns the current polling interval of a device in ms.
+        """
+        with self.__lock:
+            return self.__device(device)["interval"]
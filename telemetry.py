@@ -0,0 +1,341 @@
+"""
+Redis fan-out of PSU telemetry for horizontally scaled dashboard nodes.
+
+One acquisition node owns the instrument, publishes its readings and
+executes the commands queued by the dashboard nodes:
+
+    REDIS_URL=redis://localhost:6379 python telemetry.py --driver serial
+
+Dashboard nodes run with PSU_DRIVER=subscriber and serve the readings from
+a local cache, so adding web nodes adds no load on the instrument.
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import redis
+
+from driver import create_driver
+
+DEFAULT_PREFIX = 'bkp'
+STALE_INTERVALS = 3  # Publish intervals after which a reading is stale
+
+# Driver methods the dashboard nodes are allowed to call remotely
+COMMANDS = (
+    'set_control',
+    'set_state',
+    'set_max_output_voltage',
+    'set_output_voltage',
+    'set_max_output_current',
+    'set_output_current',
+)
+
+
+def _redis_time(r):
+    # Server clock shared by every node, so deadlines survive clock skew
+    seconds, microseconds = r.time()
+    return seconds + microseconds / 1e6
+
+
+def _channels(prefix, device):
+    return {
+        "telemetry": "{}:{}:telemetry".format(prefix, device),
+        "latest": "{}:{}:latest".format(prefix, device),
+        "commands": "{}:{}:commands".format(prefix, device),
+        "acks": "{}:{}:acks".format(prefix, device),
+    }
+
+
+class TelemetryPublisher(object):
+    """ Acquisition loop publishing the readings of one device """
+
+    POLL_INTERVAL = 0.05  # Seconds between checks of the command queue
+
+    def __init__(self,
+                 r,
+                 driver,
+                 device='psu',
+                 interval=0.5,
+                 prefix=DEFAULT_PREFIX):
+        """
+        Args:
+            r: Redis client.
+            driver: Driver of the instrument.
+            device: Name of the device.
+            interval: Seconds between readings.
+            prefix: Prefix of the Redis keys and channels.
+        """
+        self.r = r
+        self.driver = driver
+        self.device = device
+        self.interval = interval
+        self.channels = _channels(prefix, device)
+        self.logger = logging.getLogger()
+        self.__running = False
+        self.__thread = None
+
+    def publish_reading(self):
+        """
+        Reads the device and publishes the reading.
+        Returns:
+            The value dict that was published.
+        """
+        values = self.driver.read_supply_values()
+        message = json.dumps({
+            "device": self.device,
+            "timestamp": time.time(),
+            "interval": self.interval,
+            "values": values,
+        })
+        pipe = self.r.pipeline()
+        # The latest reading expires once stale, e.g. when this node dies
+        pipe.set(
+            self.channels["latest"],
+            message,
+            px=max(int(STALE_INTERVALS * self.interval * 1000), 1))
+        pipe.publish(self.channels["telemetry"], message)
+        pipe.execute()
+        return values
+
+    def execute(self, message):
+        """
+        Executes a queued command and publishes its acknowledgement.
+        Commands past their deadline are discarded, their sender already
+        reported them as failed.
+        Args:
+            message: JSON command with "id", "method", "args" and the
+                     "expires" Redis server time.
+        """
+        try:
+            command = json.loads(message)
+            command_id = command["id"]
+            expires = float(command["expires"])
+        except (ValueError, TypeError, KeyError) as e:
+            self.logger.warning("Discarding malformed command %r: %s",
+                                message, e)
+            return
+        if _redis_time(self.r) > expires:
+            self.logger.warning("Discarding expired command %s",
+                                command.get("method"))
+            return
+        ack = {"id": command_id, "ok": False}
+        try:
+            if command.get("method") not in COMMANDS:
+                raise ValueError("Unknown command {}".format(
+                    command.get("method")))
+            method = getattr(self.driver, command["method"])
+            ack["result"] = bool(method(*command.get("args", [])))
+            ack["ok"] = True
+        except (ValueError, IOError) as e:
+            ack["error"] = str(e)
+            ack["error_type"] = type(e).__name__
+        except Exception as e:
+            self.logger.exception("Command %s failed", command.get("method"))
+            ack["error"] = str(e)
+            ack["error_type"] = type(e).__name__
+        self.r.publish(self.channels["acks"], json.dumps(ack))
+
+    def run(self):
+        """
+        Publishes readings every interval and executes the commands
+        received in between, until stop() is called.
+        """
+        self.__running = True
+        next_read = time.monotonic()
+        while self.__running:
+            now = time.monotonic()
+            if now >= next_read:
+                try:
+                    self.publish_reading()
+                except IOError as e:
+                    self.logger.warning("Unable to read %s: %s", self.device,
+                                        e)
+                next_read = max(next_read + self.interval, now)
+            item = self.r.rpop(self.channels["commands"])
+            if item is None:
+                time.sleep(
+                    min(self.POLL_INTERVAL,
+                        max(next_read - time.monotonic(), 0)))
+                continue
+            self.execute(item)
+            # Acknowledged setpoints show up on the next reading at once
+            next_read = time.monotonic()
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.run)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        self.__running = False
+        if self.__thread is not None:
+            self.__thread.join()
+
+
+class TelemetrySubscriber(object):
+    """ Driver serving the readings published by an acquisition node """
+
+    def __init__(self, r, device='psu', timeout=5, prefix=DEFAULT_PREFIX):
+        """
+        Args:
+            r: Redis client.
+            device: Name of the device.
+            timeout: Seconds to wait for a command acknowledgement.
+            prefix: Prefix of the Redis keys and channels.
+        """
+        self.r = r
+        self.device = device
+        self.timeout = timeout
+        self.channels = _channels(prefix, device)
+        self.latest = None
+        self.timestamp = None
+        self.pubsub = None
+        self.__interval = None
+        self.__received_at = None
+        self.__pending = {}
+        self.__lock = threading.Lock()
+        self.__thread = None
+        self.__pid = None
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+    def __listen(self):
+        # Subscribe on first use in each process, threads do not survive
+        # gunicorn's preload fork.
+        with self.__lock:
+            if self.__pid == os.getpid():
+                return
+            self.__pid = os.getpid()
+            self.latest = None
+            self.timestamp = None
+            self.pubsub = self.r.pubsub(ignore_subscribe_messages=True)
+            self.pubsub.subscribe(
+                **{
+                    self.channels["telemetry"]: self.__on_reading,
+                    self.channels["acks"]: self.__on_ack,
+                })
+            self.__thread = self.pubsub.run_in_thread(
+                sleep_time=0.1, daemon=True)
+
+    def close(self):
+        with self.__lock:
+            if self.__thread is not None:
+                self.__thread.stop()
+                self.pubsub.close()
+            self.__thread = None
+            self.__pid = None
+
+    def __store(self, message):
+        # Staleness is measured on the local clock from the reception of
+        # the reading, so it does not depend on clock skew between nodes
+        reading = json.loads(message)
+        self.latest = reading["values"]
+        self.timestamp = reading["timestamp"]
+        self.__interval = reading["interval"]
+        self.__received_at = time.monotonic()
+
+    def __is_stale(self):
+        return (time.monotonic() - self.__received_at >
+                STALE_INTERVALS * self.__interval)
+
+    def __on_reading(self, message):
+        self.__store(message["data"])
+
+    def __on_ack(self, message):
+        ack = json.loads(message["data"])
+        with self.__lock:
+            pending = self.__pending.get(ack["id"])
+        if pending is not None:
+            pending["ack"] = ack
+            pending["event"].set()
+
+    def __command(self, method, *args):
+        self.__listen()
+        command_id = uuid.uuid4().hex
+        pending = {"event": threading.Event(), "ack": None}
+        with self.__lock:
+            self.__pending[command_id] = pending
+        try:
+            self.r.lpush(self.channels["commands"],
+                         json.dumps({
+                             "id": command_id,
+                             "method": method,
+                             "args": args,
+                             "expires": _redis_time(self.r) + self.timeout,
+                         }))
+            if not pending["event"].wait(self.timeout):
+                raise IOError("No acknowledgement for {} from {}".format(
+                    method, self.device))
+        finally:
+            with self.__lock:
+                del self.__pending[command_id]
+
+        ack = pending["ack"]
+        if not ack["ok"]:
+            if ack.get("error_type") == "ValueError":
+                raise ValueError(ack["error"])
+            raise IOError(ack["error"])
+        return ack["result"]
+
+    def set_control(self, control):
+        return self.__command('set_control', control)
+
+    def set_state(self, state):
+        return self.__command('set_state', state)
+
+    def set_max_output_voltage(self, volts):
+        return self.__command('set_max_output_voltage', volts)
+
+    def set_output_voltage(self, volts):
+        return self.__command('set_output_voltage', volts)
+
+    def set_max_output_current(self, curr):
+        return self.__command('set_max_output_current', curr)
+
+    def set_output_current(self, curr):
+        return self.__command('set_output_current', curr)
+
+    def read_supply_values(self):
+        """
+        Returns the latest published reading without touching the bus.
+        Raises IOError when no reading was published within the last
+        STALE_INTERVALS publish intervals.
+        """
+        self.__listen()
+        if self.latest is None or self.__is_stale():
+            message = self.r.get(self.channels["latest"])
+            if message is None:
+                raise IOError("No recent telemetry published for {}".format(
+                    self.device))
+            self.__store(message)
+        return self.latest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument(
+        '--driver',
+        choices=['mock', 'simulated', 'replay', 'serial'],
+        default=os.getenv('PSU_DRIVER', 'serial'))
+    parser.add_argument('--device', default='psu')
+    parser.add_argument('--interval', type=float, default=0.5)
+    parser.add_argument('--prefix', default=DEFAULT_PREFIX)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    r = redis.StrictRedis.from_url(os.environ['REDIS_URL'])
+    publisher = TelemetryPublisher(r, create_driver(args.driver),
+                                   args.device, args.interval, args.prefix)
+    publisher.run()
+
+
+if __name__ == '__main__':
+    main()